@@ -0,0 +1,144 @@
+"""
+Generator of synthetic corpora of converted documents.
+
+The synthetic documents follow the schema of the templates in `data/converted`:
+each document is a copy of a template whose pages are repeated `page_scale` times,
+with the words of every text shuffled and a new document hash. The generation is
+reproducible for a given seed.
+"""
+
+import copy
+import hashlib
+import json
+import random
+from pathlib import Path
+from typing import List
+
+from benchmarks.settings import BenchmarkSettings
+
+# Collections of the converted document holding items with a `prov`
+PROV_COLLECTIONS = [
+    "main-text",
+    "tables",
+    "figures",
+    "equations",
+    "footnotes",
+    "page-headers",
+    "page-footers",
+]
+
+# Collections which can be referenced from `main-text` with `__ref`
+REF_COLLECTIONS = [c for c in PROV_COLLECTIONS if c != "main-text"]
+
+
+def _shuffle_text(text: str, rng: random.Random) -> str:
+    words = text.split(" ")
+    rng.shuffle(words)
+    return " ".join(words)
+
+
+def _shifted_copy(items: List[dict], page_offset: int, rng: random.Random):
+    items = copy.deepcopy(items)
+    for item in items:
+        for prov in item.get("prov", []):
+            prov["page"] += page_offset
+        if "text" in item:
+            item["text"] = _shuffle_text(item["text"], rng)
+    return items
+
+
+def scale_document(
+    template: dict, page_scale: int, rng: random.Random, doc_index: int
+) -> dict:
+    """Build a synthetic document repeating the template pages `page_scale` times"""
+    document = copy.deepcopy(template)
+    num_pages = len(template.get("page-dimensions", []))
+
+    for collection in PROV_COLLECTIONS:
+        document[collection] = []
+    document["page-dimensions"] = []
+    page_hashes = []
+
+    for copy_index in range(page_scale):
+        page_offset = copy_index * num_pages
+        ref_offsets = {c: len(document.get(c) or []) for c in REF_COLLECTIONS}
+
+        for collection in PROV_COLLECTIONS:
+            items = _shifted_copy(template.get(collection) or [], page_offset, rng)
+            if collection == "main-text":
+                # Point the references to the copies of the referenced items
+                for item in items:
+                    if "__ref" in item:
+                        _, ref_collection, ref_index = item["__ref"].split("/")
+                        new_index = int(ref_index) + ref_offsets[ref_collection]
+                        item["__ref"] = f"#/{ref_collection}/{new_index}"
+            document[collection].extend(items)
+
+        for dims in template.get("page-dimensions", []):
+            document["page-dimensions"].append(
+                {**dims, "page": dims["page"] + page_offset}
+            )
+        for page_hash in template["file-info"].get("page-hashes", []):
+            page_hashes.append({**page_hash, "page": page_hash["page"] + page_offset})
+
+    doc_hash = hashlib.sha256(
+        f"{template['file-info']['document-hash']}-{doc_index}".encode()
+    ).hexdigest()
+    document["file-info"] = {
+        **template["file-info"],
+        "filename": f"synthetic-{doc_index:07d}.pdf",
+        "document-hash": doc_hash,
+        "#-pages": num_pages * page_scale,
+        "page-hashes": page_hashes,
+    }
+    document["_name"] = f"synthetic-{doc_index:07d}"
+    return document
+
+
+def generate_corpus(
+    template_dir: Path,
+    output_dir: Path,
+    num_docs: int,
+    page_scale: int = 1,
+    seed: int = 42,
+) -> List[Path]:
+    """
+    Write `num_docs` synthetic documents in the output directory
+
+    Existing documents with the same name are overwritten, and the synthetic
+    documents of a previous, larger corpus are removed, such that a corpus is always
+    identical for the same templates, size, scale and seed.
+    """
+    templates = []
+    for filename in sorted(template_dir.glob("*.json")):
+        with open(filename) as f:
+            templates.append(json.load(f))
+    if not templates:
+        raise ValueError(f"No template documents found in {template_dir}")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    output_files = []
+    for doc_index in range(num_docs):
+        template = templates[doc_index % len(templates)]
+        document = scale_document(template, page_scale, rng, doc_index)
+        output_file = output_dir / f"{document['_name']}.json"
+        with open(output_file, "w") as fw:
+            json.dump(document, fw)
+        output_files.append(output_file)
+
+    for stale_file in set(output_dir.glob("synthetic-*.json")) - set(output_files):
+        stale_file.unlink()
+    return output_files
+
+
+if __name__ == "__main__":
+    settings = BenchmarkSettings()
+    files = generate_corpus(
+        template_dir=Path(settings.template_dir),
+        output_dir=Path(settings.corpus_dir),
+        num_docs=settings.num_docs,
+        page_scale=settings.page_scale,
+        seed=settings.seed,
+    )
+    print(f"Generated {len(files)} documents in {settings.corpus_dir}")
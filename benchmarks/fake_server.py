@@ -0,0 +1,350 @@
+"""
+Local stand-in for the Deep Search endpoints used by the examples.
+
+The server emulates the paths and payloads of the Deep Search REST API which are used by
+`deepsearch-toolkit`, such that a `CpsApi` pointed at the server can run offline:
+- the user token request (`CpsApi` authentication), accepting any username and API key,
+- document uploads to a data index (`api.data_indices.upload_file()`), creating a
+  task which completes after a configurable duration,
+- the status of such tasks (`TasksApi.get_project_celery_task()`),
+- data queries (`api.queries.run()` and `run_paginated_query()`) over the documents of
+  a data index, served from a local corpus of converted documents. The search query is
+  not evaluated, every document of the data index matches, and only the default sort
+  of `DataQuery` on the document hash is supported.
+
+All the other endpoints of Deep Search are not emulated, which excludes e.g. the
+notebooks run by `nbrunner`.
+
+The state is kept in memory. Every request is delayed by a configurable latency, and a
+configurable fraction of requests (besides the token requests) is answered with a 503
+error, to exercise the retry paths of the clients.
+"""
+
+import bisect
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from benchmarks.settings import BenchmarkSettings, FakeServerSettings
+
+BENCHMARK_PROJ_KEY = "benchmark"
+BENCHMARK_INDEX_KEY = "corpus"
+
+# Path prefixes of the Deep Search services used by the toolkit
+USER_API_PREFIX = "/api/cps/user/v1"
+PUBLIC_API_PREFIX = "/api/cps/public/v1"
+QUERY_API_PATH = "/api/orchestrator/api/v1/query/run"
+
+# Sort of the data queries, the default of `DataQuery`
+DOCUMENT_SORT = [{"file-info.document-hash": "asc"}]
+
+
+class QueryTaskError(Exception):
+    """Error of a query task, reported like the errors of the query service"""
+
+    def __init__(self, task_id: str, message: str):
+        super().__init__(message)
+        self.task_id = task_id
+        self.message = message
+
+
+def _select_source(document: dict, source: Optional[List[str]]) -> dict:
+    """Keep only the (dotted) fields of the document listed in `source`"""
+    if source is None:
+        return document
+    selected: dict = {}
+    for field in source:
+        value = document
+        keys = field.split(".")
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = selected
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = value
+    return selected
+
+
+class FakeDeepSearchState:
+    def __init__(self, settings: FakeServerSettings):
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.rng = random.Random(settings.seed)
+        self.indices: Dict[str, Dict[str, dict]] = {}  # proj_key -> index_key -> index
+        self.tasks: Dict[str, dict] = {}
+
+    def add_index(
+        self, proj_key: str, index_key: str, name: str, documents: List[Path]
+    ):
+        """Register a data index whose documents are read from the given files"""
+        # The documents are sorted by hash, for the pagination of the data queries
+        entries = []
+        for path in documents:
+            with open(path) as f:
+                entries.append((json.load(f)["file-info"]["document-hash"], path))
+        entries.sort()
+        with self.lock:
+            self.indices.setdefault(proj_key, {})[index_key] = {
+                "name": name,
+                "hashes": [h for h, _ in entries],
+                "documents": [path for _, path in entries],
+            }
+
+    def random(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def create_task(self, proj_key: str, index_key: str, body: dict) -> str:
+        task_id = uuid.uuid4().hex
+        failed = self.random() < self.settings.task_failure_rate
+        with self.lock:
+            self.tasks[task_id] = {
+                "proj_key": proj_key,
+                "index_key": index_key,
+                "created": time.monotonic(),
+                "status": "FAILURE" if failed else "SUCCESS",
+                "body": body,
+            }
+        return task_id
+
+    def task_status(self, proj_key: str, task_id: str) -> Optional[dict]:
+        task = self.tasks.get(task_id)
+        if task is None or task["proj_key"] != proj_key:
+            return None
+        elapsed = time.monotonic() - task["created"]
+        status = (
+            task["status"] if elapsed >= self.settings.task_duration_s else "PENDING"
+        )
+        return {"task_id": task_id, "task_status": status, "result": None}
+
+    def elastic_query(self, task: dict) -> Tuple[dict, Optional[dict]]:
+        """
+        Run an `ElasticQuery` task of a query flow
+
+        Returns the outputs of the task and the parameters of its next page, if any.
+        Like the `search_after` pagination of Elasticsearch, there is a next page after
+        every non-empty page.
+        """
+        resource = task.get("@resource") or {}
+        index = self.indices.get(resource.get("proj_key"), {}).get(
+            resource.get("index")
+        )
+        if index is None:
+            raise QueryTaskError(task["id"], "Data index not found")
+
+        parameters = task["parameters"]
+        if parameters.get("sort", DOCUMENT_SORT) != DOCUMENT_SORT:
+            raise QueryTaskError(task["id"], f"Unsupported sort {parameters['sort']}")
+
+        hashes = index["hashes"]
+        search_after = parameters.get("search_after")
+        start = bisect.bisect_right(hashes, search_after[0]) if search_after else 0
+        end = min(start + int(parameters.get("limit", 20)), len(hashes))
+
+        items = []
+        for doc_hash, path in zip(hashes[start:end], index["documents"][start:end]):
+            with open(path) as f:
+                document = json.load(f)
+            items.append(
+                {
+                    "_id": doc_hash,
+                    "_source": _select_source(document, parameters.get("source")),
+                    "sort": [doc_hash],
+                }
+            )
+
+        outputs = {"items": items, "total": len(hashes), "aggregations": {}}
+        next_page = {"search_after": [hashes[end - 1]]} if items else None
+        return outputs, next_page
+
+
+def _route_pattern(template: str) -> str:
+    return re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", template)
+
+
+class FakeDeepSearchHandler(BaseHTTPRequestHandler):
+    server: "FakeDeepSearchServer"
+
+    routes = [
+        ("POST", USER_API_PREFIX + "/user/token", "get_access_token"),
+        (
+            "POST",
+            PUBLIC_API_PREFIX
+            + "/project/{proj_key}/data_indices/{index_key}/actions/ccs_convert_upload",
+            "upload_file",
+        ),
+        (
+            "GET",
+            PUBLIC_API_PREFIX + "/project/{proj_key}/celery_tasks/{task_id}",
+            "get_task",
+        ),
+        ("POST", QUERY_API_PATH, "run_query"),
+    ]
+
+    # Requests never answered with an injected fault, not to fail the API creation
+    reliable_actions = {"get_access_token"}
+
+    def log_message(self, format, *args):
+        pass  # keep the benchmark output clean
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method: str):
+        state = self.server.state
+        settings = state.settings
+
+        latency = settings.latency_ms + state.random() * settings.latency_jitter_ms
+        time.sleep(latency / 1000)
+
+        path = urlsplit(self.path).path
+        for route_method, template, action in self.routes:
+            match = re.fullmatch(_route_pattern(template), path)
+            if route_method == method and match:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length)) if length else {}
+                if (
+                    action not in self.reliable_actions
+                    and state.random() < settings.fault_rate
+                ):
+                    return self._send(503, {"detail": "Injected fault"})
+                status, payload = getattr(self, action)(body=body, **match.groupdict())
+                return self._send(status, payload)
+
+        self._send(404, {"detail": f"No route for {method} {path}"})
+
+    def _send(self, status: int, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def get_access_token(self, body: dict):
+        return 200, {"access_token": uuid.uuid4().hex}
+
+    def upload_file(self, body: dict, proj_key: str, index_key: str):
+        if index_key not in self.server.state.indices.get(proj_key, {}):
+            return 404, {"detail": "Data index not found"}
+        task_id = self.server.state.create_task(proj_key, index_key, body)
+        return 200, {
+            "task_id": task_id,
+            "task_status": "PENDING",
+            "task_type": "ccs_convert_upload",
+        }
+
+    def get_task(self, body: dict, proj_key: str, task_id: str):
+        status = self.server.state.task_status(proj_key, task_id)
+        if status is None:
+            return 404, {"detail": "Task not found"}
+        return 200, status
+
+    def run_query(self, body: dict):
+        flow = body["query"]["template"]
+        start = time.monotonic()
+
+        task_outputs, next_pages, task_timings = {}, {}, {}
+        for task in flow["tasks"]:
+            task_start = time.monotonic()
+            try:
+                if task["kind"] != "ElasticQuery":
+                    raise QueryTaskError(
+                        task["id"], f"Unsupported task kind {task['kind']}"
+                    )
+                outputs, next_page = self.server.state.elastic_query(task)
+            except QueryTaskError as e:
+                return 400, {
+                    "task_id": e.task_id,
+                    "message": e.message,
+                    "error_type": "TaskError",
+                    "detail": None,
+                }
+            task_outputs[task["id"]] = outputs
+            if next_page is not None:
+                next_pages[task["id"]] = next_page
+            task_timings[task["id"]] = {
+                "overall": time.monotonic() - task_start,
+                "details": {},
+            }
+
+        return 200, {
+            "result": {
+                "outputs": {
+                    name: task_outputs[output["task_id"]][output["output_id"]]
+                    for name, output in flow["outputs"].items()
+                },
+                "next_pages": next_pages,
+                "timings": {
+                    "overall": time.monotonic() - start,
+                    "tasks": task_timings,
+                },
+            }
+        }
+
+
+class FakeDeepSearchServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # allow bursts of concurrent clients
+
+    def __init__(self, settings: Optional[FakeServerSettings] = None):
+        _settings = settings or FakeServerSettings()
+        super().__init__((_settings.host, _settings.port), FakeDeepSearchHandler)
+        self.state = FakeDeepSearchState(_settings)
+
+    def handle_error(self, request, client_address):
+        # Clients stopped in the middle of a request are expected, e.g. a killed run
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+@contextmanager
+def running_server(settings: Optional[FakeServerSettings] = None):
+    """Run the fake server in a background thread for the duration of the context"""
+    server = FakeDeepSearchServer(settings)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+if __name__ == "__main__":
+    bm_settings = BenchmarkSettings()
+    server = FakeDeepSearchServer()
+    server.state.add_index(
+        proj_key=BENCHMARK_PROJ_KEY,
+        index_key=BENCHMARK_INDEX_KEY,
+        name="benchmark corpus",
+        documents=sorted(Path(bm_settings.corpus_dir).glob("*.json")),
+    )
+    print(f"Fake Deep Search server listening on {server.url}")
+    print(
+        f"Use it with DEEPSEARCH_HOST={server.url} DEEPSEARCH_USERNAME=benchmark "
+        "DEEPSEARCH_API_KEY=benchmark DEEPSEARCH_VERIFY_SSL=false"
+    )
+    server.serve_forever()
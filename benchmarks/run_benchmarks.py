@@ -0,0 +1,428 @@
+"""
+Offline benchmarks of the example tools, against the fake Deep Search server and a
+synthetic corpus.
+
+The examples talk to the fake server through the `CpsApi` of deepsearch-toolkit, as
+they would to a Deep Search instance.
+
+Each benchmark run is executed in a fresh process, such that its peak memory can be
+measured independently of the other runs. The results of all runs are saved as JSON
+and summarized in a table.
+"""
+
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager, redirect_stdout
+from pathlib import Path
+from types import ModuleType
+from typing import Callable, Dict, List
+
+import requests
+from deepsearch.core.client.settings import ProfileSettings
+from deepsearch.cps.client.api import CpsApi
+from deepsearch.cps.client.components.data_indices import (
+    ElasticProjectDataCollectionSource,
+)
+from deepsearch.cps.queries import DataQuery
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.fake_server import (
+    BENCHMARK_INDEX_KEY,
+    BENCHMARK_PROJ_KEY,
+    running_server,
+)
+from benchmarks.settings import BenchmarkSettings, FakeServerSettings
+
+EXAMPLES_DIR = Path(__file__).resolve().parent.parent / "examples"
+UPLOAD_INDEX_KEY = "uploads"
+
+
+@contextmanager
+def _chdir(path: Path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def load_example_module(relative_path: str) -> ModuleType:
+    """Import an example script, which is not part of a package, as a module"""
+    path = EXAMPLES_DIR / relative_path
+    # The scripts import their sibling modules as top-level modules
+    if str(path.parent) not in sys.path:
+        sys.path.insert(0, str(path.parent))
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _benchmark_api(api_url: str) -> CpsApi:
+    """A toolkit API object using the fake server, which accepts any credentials"""
+    settings = ProfileSettings(
+        host=api_url, username="benchmark", api_key="benchmark", verify_ssl=False
+    )
+    return CpsApi.from_settings(settings)
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def _at(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {"p50": _at(0.50), "p95": _at(0.95), "max": ordered[-1]}
+
+
+def bench_upload(
+    api_url: str, settings: BenchmarkSettings, work_dir: Path
+) -> Dict[str, float]:
+    """Upload of URL batches with `run_batch_upload.py`, including task polling"""
+    # The script configures a log file in the current directory when imported
+    with _chdir(work_dir):
+        upload = load_example_module("document_bulk_upload/run_batch_upload.py")
+    upload.TASK_POLL_SLEEP_DURATION = settings.task_poll_interval_s
+
+    api = _benchmark_api(api_url)
+    coords = ElasticProjectDataCollectionSource(
+        proj_key=BENCHMARK_PROJ_KEY, index_key=UPLOAD_INDEX_KEY
+    )
+    urls = [f"https://example.com/{i:07d}.pdf" for i in range(settings.num_upload_urls)]
+    batches = upload.chunk_list(urls, settings.upload_batch_size)
+
+    # The latency of a task runs from its submission, i.e. once the semaphore of the
+    # concurrent uploads is acquired, until its final status is received. The end-to-
+    # end time also includes the wait for the semaphore.
+    latencies, end_to_end = [], []
+    submitted: Dict[str, float] = {}
+    upload_file = api.data_indices.upload_file
+    wait_for_task = upload.wait_for_task
+
+    def _timed_upload_file(coords, body):
+        start = time.monotonic()
+        task_id = upload_file(coords=coords, body=body)
+        submitted[task_id] = start
+        return task_id
+
+    async def _timed_wait_for_task(api, coords, task_id):
+        try:
+            return await wait_for_task(api, coords, task_id)
+        finally:
+            latencies.append(time.monotonic() - submitted[task_id])
+
+    api.data_indices.upload_file = _timed_upload_file
+    upload.wait_for_task = _timed_wait_for_task
+
+    async def _timed_upload(url_batch, semaphore):
+        start = time.monotonic()
+        result = await upload.upload_for_urls(api, coords, url_batch, False, semaphore)
+        end_to_end.append(time.monotonic() - start)
+        return result
+
+    async def _run():
+        semaphore = asyncio.Semaphore(settings.upload_concurrency)
+        return await asyncio.gather(*[_timed_upload(b, semaphore) for b in batches])
+
+    start = time.monotonic()
+    results = asyncio.run(_run())
+    elapsed = time.monotonic() - start
+
+    n_ok = sum(
+        len(batch)
+        for batch, report in results
+        if report is not None and report["task_status"] == "SUCCESS"
+    )
+    return {
+        "elapsed_s": elapsed,
+        "items": len(urls),
+        "items_ok": n_ok,
+        "throughput_per_s": len(urls) / elapsed,
+        **{f"latency_{k}_s": v for k, v in _percentiles(latencies).items()},
+        **{f"end_to_end_{k}_s": v for k, v in _percentiles(end_to_end).items()},
+    }
+
+
+def bench_extraction(
+    api_url: str, settings: BenchmarkSettings, work_dir: Path
+) -> Dict[str, float]:
+    """
+    Extraction of tables and figures with `extract_tables.py` and `extract_figures.py`
+
+    The synthetic corpus has no PDF files, hence the cropping of the figures with
+    `pdftoppm` is skipped, and only the processing of the converted documents is
+    measured, i.e. the CSV export of the tables and the caption and text lookup of the
+    figures.
+    """
+    extract_tables = load_example_module(
+        "document_conversion_extract_tables/extract_tables.py"
+    )
+    extract_figures = load_example_module(
+        "document_conversion_extract_figures/extract_figures.py"
+    )
+    extract_figures.crop_pdf_to_image = lambda *args, **kwargs: None
+    json_files = sorted(Path(settings.corpus_dir).glob("*.json"))
+
+    latencies = []
+    n_tables, n_figures = 0, 0
+    start = time.monotonic()
+    for json_file in json_files:
+        doc_start = time.monotonic()
+        with open(json_file) as f:
+            document = json.load(f)
+        pdf_filename = json_file.with_suffix(".pdf")
+        extract_tables.extract_tables_from_json_doc(pdf_filename, document, work_dir)
+        extract_figures.extract_figures_from_json_doc(
+            pdf_filename, document, work_dir, resolution=72
+        )
+        n_tables += len(document.get("tables", []))
+        n_figures += len(document.get("figures", []))
+        latencies.append(time.monotonic() - doc_start)
+    elapsed = time.monotonic() - start
+
+    return {
+        "elapsed_s": elapsed,
+        "items": len(json_files),
+        "tables": n_tables,
+        "figures": n_figures,
+        "throughput_per_s": len(json_files) / elapsed,
+        **{f"latency_{k}_s": v for k, v in _percentiles(latencies).items()},
+    }
+
+
+def bench_query_export(
+    api_url: str, settings: BenchmarkSettings, work_dir: Path
+) -> Dict[str, float]:
+    """
+    Export of a whole data index to JSONL with `run_paginated_query()` of the toolkit
+
+    The toolkit does not retry the page requests, hence a page failing with a 5xx
+    error is retried here, resuming the pagination from the failed page.
+    """
+    api = _benchmark_api(api_url)
+    query = DataQuery(
+        "*",
+        limit=settings.query_page_size,
+        coordinates=ElasticProjectDataCollectionSource(
+            proj_key=BENCHMARK_PROJ_KEY, index_key=BENCHMARK_INDEX_KEY
+        ),
+    )
+
+    latencies = []
+    n_docs, n_retries, n_failures = 0, 0, 0
+    last_page = None
+    start = time.monotonic()
+    with open(work_dir / "export.jsonl", "w") as fw:
+        while True:
+            page_start = time.monotonic()
+            try:
+                # The parameters of the paginated task point to the page to fetch
+                # next, such that a new cursor resumes from the failed page
+                for result_page in api.queries.run_paginated_query(query):
+                    # The last page is yielded twice by the toolkit
+                    if result_page is last_page:
+                        continue
+                    last_page = result_page
+                    latencies.append(time.monotonic() - page_start)
+                    for row in result_page.outputs["data_outputs"]:
+                        fw.write(json.dumps(row["_source"]) + "\n")
+                        n_docs += 1
+                    n_failures = 0
+                    page_start = time.monotonic()
+                break
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else 0
+                if status < 500 or n_failures >= settings.query_max_retries:
+                    raise
+                time.sleep(settings.query_retry_backoff_s * 2**n_failures)
+                n_failures += 1
+                n_retries += 1
+    elapsed = time.monotonic() - start
+
+    return {
+        "elapsed_s": elapsed,
+        "items": n_docs,
+        "retries": n_retries,
+        "throughput_per_s": n_docs / elapsed,
+        **{f"page_latency_{k}_s": v for k, v in _percentiles(latencies).items()},
+    }
+
+
+BENCHMARKS: Dict[str, Callable[[str, BenchmarkSettings, Path], Dict[str, float]]] = {
+    "upload": bench_upload,
+    "extraction": bench_extraction,
+    "query_export": bench_query_export,
+}
+
+
+def _run_in_process(name: str, api_url: str, settings_dict: dict, result_queue):
+    settings = BenchmarkSettings(**settings_dict)
+    # The example functions report every output file, which is not part of the benchmark
+    with tempfile.TemporaryDirectory() as work_dir, open(os.devnull, "w") as devnull:
+        try:
+            with redirect_stdout(devnull):
+                metrics = BENCHMARKS[name](api_url, settings, Path(work_dir))
+        except Exception as e:
+            result_queue.put({"error": repr(e)})
+            return
+    # ru_maxrss is in KiB on Linux
+    metrics["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    result_queue.put(metrics)
+
+
+class BenchmarkRunner:
+    def __init__(self, settings: BenchmarkSettings = None):
+        self.settings = settings or BenchmarkSettings()
+        self.server_settings = FakeServerSettings()
+
+        self.run_id = uuid.uuid4().hex
+        print(f"{self.run_id=}")
+
+        self.output_dir_path = Path(self.settings.output_root_dir)
+        self.output_dir_path.mkdir(parents=True, exist_ok=True)
+
+    def prepare_corpus(self) -> List[Path]:
+        print(
+            f"Generating {self.settings.num_docs} documents "
+            f"(page scale {self.settings.page_scale}) in {self.settings.corpus_dir}"
+        )
+        return generate_corpus(
+            template_dir=Path(self.settings.template_dir),
+            output_dir=Path(self.settings.corpus_dir),
+            num_docs=self.settings.num_docs,
+            page_scale=self.settings.page_scale,
+            seed=self.settings.seed,
+        )
+
+    def run_benchmark(self, name: str, api_url: str) -> dict:
+        ctx = multiprocessing.get_context("spawn")
+        result_queue = ctx.Queue()
+        process = ctx.Process(
+            target=_run_in_process,
+            args=(name, api_url, self.settings.dict(), result_queue),
+        )
+        process.start()
+
+        # The process may die without a result, e.g. when killed for lack of memory
+        deadline = time.monotonic() + self.settings.run_timeout_s
+        metrics = None
+        while metrics is None:
+            # A result sent right before exiting is still received by the next get
+            exited = process.exitcode is not None
+            try:
+                metrics = result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if exited:
+                    metrics = {
+                        "error": f"Process exited with code {process.exitcode} "
+                        "without a result"
+                    }
+                elif time.monotonic() > deadline:
+                    process.terminate()
+                    metrics = {"error": f"Timeout after {self.settings.run_timeout_s}s"}
+        process.join()
+        return metrics
+
+    def print_summary_table(self, results: Dict[str, List[dict]]):
+        table = Table(title="Benchmarks", show_lines=True)
+        for column in [
+            "Benchmark",
+            "Runs",
+            "Items",
+            "Throughput (items/s)",
+            "Latency p50 (s)",
+            "Latency p95 (s)",
+            "Peak RSS (MB)",
+        ]:
+            table.add_column(column)
+
+        for name, runs in results.items():
+            ok_runs = [r for r in runs if "error" not in r]
+            if not ok_runs:
+                table.add_row(name, str(len(runs)), "ERROR", "", "", "", "")
+                continue
+
+            def _median(suffix: str) -> str:
+                values = [
+                    v for r in ok_runs for k, v in r.items() if k.endswith(suffix)
+                ]
+                return f"{statistics.median(values):.3f}" if values else ""
+
+            table.add_row(
+                name,
+                f"{len(ok_runs)}/{len(runs)}",
+                str(ok_runs[0]["items"]),
+                _median("throughput_per_s"),
+                _median("latency_p50_s"),
+                _median("latency_p95_s"),
+                _median("peak_rss_mb"),
+            )
+
+        console = Console(force_terminal=True)
+        console.print(table)
+
+    def run(self):
+        self.prepare_corpus()
+        corpus_files = sorted(Path(self.settings.corpus_dir).glob("*.json"))
+
+        results: Dict[str, List[dict]] = {}
+        with running_server(self.server_settings) as server:
+            state = server.state
+            state.add_index(
+                BENCHMARK_PROJ_KEY,
+                BENCHMARK_INDEX_KEY,
+                "benchmark corpus",
+                corpus_files,
+            )
+            state.add_index(BENCHMARK_PROJ_KEY, UPLOAD_INDEX_KEY, "uploads", [])
+
+            for name in self.settings.benchmarks:
+                results[name] = []
+                for i in range(self.settings.repeat):
+                    print(f"[{name} {i + 1}/{self.settings.repeat}] Running")
+                    metrics = self.run_benchmark(name, server.url)
+                    if "error" in metrics:
+                        print(f"=> Error during {name}: {metrics['error']}")
+                    results[name].append(metrics)
+
+        output_filename = self.output_dir_path / f"{self.run_id}.json"
+        with open(output_filename, "w") as fw:
+            json.dump(
+                {
+                    "run_id": self.run_id,
+                    "platform": platform.platform(),
+                    "python": platform.python_version(),
+                    "cpu_count": os.cpu_count(),
+                    "settings": self.settings.dict(),
+                    "server_settings": self.server_settings.dict(),
+                    "results": results,
+                },
+                fw,
+                indent=2,
+            )
+
+        print(80 * "-")
+        self.print_summary_table(results)
+        print(80 * "-")
+        print(f"Results saved in {output_filename}")
+
+
+if __name__ == "__main__":
+    runner = BenchmarkRunner()
+    runner.run()
@@ -0,0 +1,50 @@
+from typing import List
+
+from dotenv import find_dotenv
+from pydantic.v1 import BaseSettings
+
+
+class FakeServerSettings(BaseSettings):
+    class Config:
+        env_prefix = "DS_BM_SERVER_"
+        env_file = find_dotenv()
+        env_file_encoding = "utf-8"
+
+    host: str = "127.0.0.1"
+    port: int = 0  # 0 picks a free port
+
+    latency_ms: float = 20.0  # latency added to every request
+    latency_jitter_ms: float = 5.0  # max random extra latency
+    task_duration_s: float = 0.5  # time for an upload task to complete
+    task_failure_rate: float = 0.0  # fraction of upload tasks ending in FAILURE
+    fault_rate: float = 0.0  # fraction of requests answered with a 5xx error
+
+    seed: int = 42
+
+
+class BenchmarkSettings(BaseSettings):
+    class Config:
+        env_prefix = "DS_BM_"
+        env_file = find_dotenv()
+        env_file_encoding = "utf-8"
+
+    template_dir: str = "./data/converted"
+    corpus_dir: str = ".local/benchmarks/corpus"
+    output_root_dir: str = ".local/benchmarks/results"
+
+    num_docs: int = 200  # size of the synthetic corpus
+    page_scale: int = 1  # each synthetic doc repeats the template pages this many times
+    seed: int = 42
+
+    benchmarks: List[str] = ["upload", "extraction", "query_export"]
+    repeat: int = 3  # number of runs of each benchmark
+    run_timeout_s: float = 3600  # a run still going after this is stopped
+
+    num_upload_urls: int = 500
+    upload_batch_size: int = 1
+    upload_concurrency: int = 20
+    task_poll_interval_s: float = 0.1
+
+    query_page_size: int = 50
+    query_max_retries: int = 5  # retries of a page request failing with a 5xx error
+    query_retry_backoff_s: float = 0.1  # doubled after each retry
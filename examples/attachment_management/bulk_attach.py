@@ -0,0 +1,294 @@
+# Copyright IBM Inc. All rights reserved.
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+This script attaches files to many index items of a project data index in bulk.
+
+Compared to the lookup used in the manage_attachments.ipynb notebook, which paginates
+through the whole collection for every single item, this script
+- resolves the index items in batches with a single `_id` terms query per batch,
+- keeps a local cache of `_id` -> (`_s3_data`, attachments) in a JSON file,
+- uploads the attachments concurrently.
+
+Changes to the attachments take some time to become visible to search. After the
+upload, the cache entries of the modified items are refreshed after a delay, and the
+entries which do not show the new attachments yet are kept as stale, to be resolved
+again on the next run.
+
+The input is a CSV file with the columns `index_item_id,attachment_path`. The same item
+can appear on multiple rows, one for each file to attach.
+
+$ python bulk_attach.py --help
+
+ Usage: bulk_attach.py [OPTIONS]
+
+╭─ Options ───────────────────────────────────────────────────────────────────────────────────────────────────╮
+│ *          -i      PATH     CSV file with the index_item_id,attachment_path rows [default: None] [required] │
+│ *          -p      TEXT     Deep Search project key [default: None] [required]                              │
+│ *          -c      TEXT     Deep Search collection (index) key [default: None] [required]                   │
+│            -k      TEXT     Attachment key, must be of the form usr_<snake_case> [default: usr_attachments] │
+│            -o      PATH     Local cache of the index items [default: attachments_cache.json]                │
+│            -b      INTEGER  Number of item ids resolved in a single query [default: 500]                    │
+│            -n      INTEGER  Number of concurrent attachment uploads [default: 8]                            │
+│            -w      FLOAT    Seconds to wait before refreshing the modified items [default: 3]               │
+│            -f      TEXT     Profile to use. If not set, active profile will be used [default: None]         │
+│    --help                   Show this message and exit.                                                     │
+╰─────────────────────────────────────────────────────────────────────────────────────────────────────────────╯
+
+
+For example, run as
+$ python bulk_attach.py -i attachments.csv -p $PROJ_KEY -c $INDEX_KEY
+"""
+
+import asyncio
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import deepsearch as ds
+import typer
+from deepsearch.cps.client.components.elastic import ElasticProjectDataCollectionSource
+from deepsearch.cps.queries import DataQuery
+
+chunk_list = lambda lst, n: [lst[i : i + n] for i in range(0, len(lst), n)]
+
+
+class IndexItemCache:
+    """
+    Local cache of index items, keyed by `_id`
+
+    Each entry holds the `_s3_data` of the item, which contains its attachments
+    grouped by attachment key. Entries marked as stale no longer reflect the item in
+    the index and have to be resolved again.
+    """
+
+    def __init__(self, cache_file: Path):
+        self.cache_file = cache_file
+        self.items: Dict[str, dict] = {}
+        if cache_file.exists():
+            self.items = json.loads(cache_file.read_text())
+
+    def __contains__(self, index_item_id: str) -> bool:
+        return index_item_id in self.items
+
+    def is_stale(self, index_item_id: str) -> bool:
+        return self.items.get(index_item_id, {}).get("stale", False)
+
+    def update(self, index_item_id: str, s3_data: dict):
+        self.items[index_item_id] = {"_s3_data": s3_data}
+
+    def mark_stale(self, index_item_id: str):
+        self.items[index_item_id]["stale"] = True
+
+    def attachments(self, index_item_id: str, attch_key: str) -> List[dict]:
+        s3_data = self.items.get(index_item_id, {}).get("_s3_data", {})
+        return s3_data.get(attch_key, [])
+
+    def save(self):
+        self.cache_file.write_text(json.dumps(self.items))
+
+
+def resolve_index_items(
+    api,
+    coordinates: ElasticProjectDataCollectionSource,
+    index_item_ids: List[str],
+    batch_size: int = 500,
+) -> Dict[str, dict]:
+    """
+    Fetch the `_s3_data` of the given index items with one terms query per batch
+
+    Parameters
+    ----------
+    api : CpsApi
+        Deep Search API client.
+    coordinates : ElasticProjectDataCollectionSource
+        Coordinates of the project data index.
+    index_item_ids : List[str]
+        Ids of the index items to resolve.
+    batch_size : int, Default=500
+        Number of ids included in a single query. Keep it below the max clause count
+        of the search backend (1024 by default).
+
+    Returns
+    -------
+    Dict[str, dict]
+        Mapping of the found item ids to their `_s3_data`. Ids which are not found in
+        the index are not included.
+    """
+    found = {}
+    for batch in chunk_list(index_item_ids, batch_size):
+        terms = " OR ".join(f'"{item_id}"' for item_id in batch)
+        query = DataQuery(
+            search_query=f"_id:({terms})",
+            source=["_id", "_s3_data"],
+            limit=len(batch),
+            coordinates=coordinates,
+        )
+        cursor = api.queries.run_paginated_query(query)
+        for result_page in cursor:
+            for item in result_page.outputs["data_outputs"]:
+                found[item["_id"]] = item["_source"].get("_s3_data", {})
+    return found
+
+
+def read_attachment_list(input_file: Path) -> List[Tuple[str, str]]:
+    with open(input_file, newline="") as f:
+        reader = csv.DictReader(f)
+        return [(row["index_item_id"], row["attachment_path"]) for row in reader]
+
+
+async def attach_files(
+    api,
+    index,
+    attachments: Iterable[Tuple[str, str]],
+    attch_key: str,
+    concurrency: int,
+) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Upload the attachments concurrently, returning (item_id, path, error) triples
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _attach(pool, index_item_id: str, attachment_path: str):
+        async with semaphore:  # This will limit the number of concurrent uploads
+            try:
+                # add_item_attachment is blocking, run it in the thread pool
+                await loop.run_in_executor(
+                    pool,
+                    partial(
+                        index.add_item_attachment,
+                        api=api,
+                        index_item_id=index_item_id,
+                        attachment_path=attachment_path,
+                        attachment_key=attch_key,
+                    ),
+                )
+                return index_item_id, attachment_path, None
+            except Exception as e:
+                return index_item_id, attachment_path, str(e)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return await asyncio.gather(*[_attach(pool, i, p) for i, p in attachments])
+
+
+def main(
+    input_file: Path = typer.Option(
+        ..., "-i", help="CSV file with the index_item_id,attachment_path rows"
+    ),
+    proj_key: str = typer.Option(..., "-p", help="Deep Search project key"),
+    index_key: str = typer.Option(..., "-c", help="Deep Search collection (index) key"),
+    attch_key: str = typer.Option(
+        "usr_attachments",
+        "-k",
+        help="Attachment key, must be of the form usr_<snake_case>",
+    ),
+    cache_file: Path = typer.Option(
+        "attachments_cache.json", "-o", help="Local cache of the index items"
+    ),
+    batch_size: int = typer.Option(
+        500, "-b", help="Number of item ids resolved in a single query"
+    ),
+    concurrency: int = typer.Option(
+        8, "-n", help="Number of concurrent attachment uploads"
+    ),
+    wait_s: float = typer.Option(
+        3, "-w", help="Seconds to wait before refreshing the modified items"
+    ),
+    profile_name: Optional[str] = typer.Option(
+        None,
+        "-f",
+        help="Profile to use. If not set, active profile will be used",
+    ),
+):
+
+    api = ds.CpsApi.from_env(profile_name=profile_name)
+    coordinates = ElasticProjectDataCollectionSource(
+        proj_key=proj_key, index_key=index_key
+    )
+    indices = api.data_indices.list(proj_key=proj_key)
+    index = next((x for x in indices if x.source.index_key == index_key), None)
+    if index is None:
+        typer.secho(f"Index {index_key} not found.", fg=typer.colors.RED)
+        raise typer.Exit(code=1)
+
+    attachments = read_attachment_list(input_file)
+    cache = IndexItemCache(cache_file)
+
+    # Resolve only the items which are not in the local cache yet, or are stale
+    item_ids = list(dict.fromkeys(item_id for item_id, _ in attachments))
+    missing_ids = [
+        item_id
+        for item_id in item_ids
+        if item_id not in cache or cache.is_stale(item_id)
+    ]
+    typer.secho(
+        f"Resolving {len(missing_ids)} of {len(item_ids)} items", fg=typer.colors.BLUE
+    )
+    for item_id, s3_data in resolve_index_items(
+        api, coordinates, missing_ids, batch_size=batch_size
+    ).items():
+        cache.update(item_id, s3_data)
+    cache.save()
+
+    unknown_ids = {item_id for item_id in item_ids if item_id not in cache}
+    for item_id in unknown_ids:
+        typer.secho(f"Index item {item_id} not found.", fg=typer.colors.YELLOW)
+
+    # Upload the attachments
+    to_attach = [(i, p) for i, p in attachments if i not in unknown_ids]
+    typer.secho(f"Uploading {len(to_attach)} attachments", fg=typer.colors.BLUE)
+    results = asyncio.run(
+        attach_files(api, index, to_attach, attch_key, concurrency=concurrency)
+    )
+    n_err = 0
+    expected_counts = {}  # item id -> number of attachments expected after the upload
+    for item_id, attachment_path, error in results:
+        if error is not None:
+            n_err += 1
+            typer.secho(
+                f"Error attaching {attachment_path} to {item_id}: {error}",
+                fg=typer.colors.RED,
+            )
+            continue
+        if item_id not in expected_counts:
+            expected_counts[item_id] = len(cache.attachments(item_id, attch_key))
+            cache.mark_stale(item_id)
+        expected_counts[item_id] += 1
+    cache.save()
+
+    # Refresh the cache entries of the items which were modified, once the new
+    # attachments are visible to search
+    time.sleep(wait_s)
+    for item_id, s3_data in resolve_index_items(
+        api, coordinates, list(expected_counts), batch_size=batch_size
+    ).items():
+        n_attachments = len(s3_data.get(attch_key, []))
+        if n_attachments >= expected_counts[item_id]:
+            cache.update(item_id, s3_data)
+    n_stale = sum(cache.is_stale(item_id) for item_id in expected_counts)
+    if n_stale:
+        typer.secho(
+            f"{n_stale} items do not show their new attachments yet, "
+            "they will be resolved again on the next run",
+            fg=typer.colors.YELLOW,
+        )
+    cache.save()
+
+    typer.secho(
+        f"Attached {len(results) - n_err}/{len(results)} files. "
+        f"Item cache saved in {cache_file}",
+        fg=typer.colors.GREEN if n_err == 0 else typer.colors.YELLOW,
+    )
+
+
+if __name__ == "__main__":
+    app = typer.Typer(no_args_is_help=True, add_completion=False)
+    app.command()(main)
+    app()
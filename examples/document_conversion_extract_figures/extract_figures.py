@@ -41,6 +41,7 @@ from zipfile import ZipFile
 
 import deepsearch as ds
 import typer
+from spatial_index import DocumentSpatialIndex
 
 
 def crop_pdf_to_image(
@@ -98,6 +99,9 @@ def extract_figures_from_json_doc(
     """
     Iterate through the converted document format and extract the figures as PNG files
 
+    Next to each PNG file, a JSON file is saved with the caption of the figure and the
+    text lying inside the figure, as found with a spatial index of the document.
+
     Parameters
     ----------
     pdf_filename : Path
@@ -116,6 +120,8 @@ def extract_figures_from_json_doc(
         ".PDF"
     )
     page_counters = {}
+    # Index the bounding boxes of the document once, for the region queries of all figures
+    spatial_index = DocumentSpatialIndex(document)
     # Iterate through all the figures identified in the converted document
     for figure in document.get("figures", []):
         prov = figure["prov"][0]
@@ -154,6 +160,22 @@ def extract_figures_from_json_doc(
         )
         typer.secho(f"Figure extracted in {output_filename}.png", fg=typer.colors.GREEN)
 
+        # Save the caption and the text inside the figure
+        caption = figure.get("text")
+        if not caption:
+            captions = spatial_index.nearest(
+                page, prov["bbox"], k=1, types={"caption"}, max_distance=50
+            )
+            caption = captions[0]["text"] if captions else None
+        inner_text = [
+            entry["text"]
+            for entry in spatial_index.contained_in(
+                page, prov["bbox"], kinds={"cells", "main-text"}, tolerance=1.0
+            )
+        ]
+        with open(f"{output_filename}.json", "w") as fw:
+            json.dump({"caption": caption, "text": inner_text}, fw, indent=2)
+
 
 def main(
     pdf_filename: Path = typer.Option(..., "-i", help="Input PDF filename"),
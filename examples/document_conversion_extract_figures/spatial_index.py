@@ -0,0 +1,496 @@
+# Copyright IBM Inc. All rights reserved.
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Spatial index over the bounding boxes of a converted document.
+
+For each page, the bounding boxes of the document items (`main-text`, tables, figures, ...)
+and of the raw cells inside figures and tables are stored in a NumPy array, together with a
+uniform grid which maps each grid cell to the boxes overlapping it. This allows answering
+region queries, like "which text lies inside this figure" or "which caption is closest to
+this table", without scanning the whole document for every query.
+
+Example usage:
+
+    index = DocumentSpatialIndex(document)
+    figure = document["figures"][0]
+    prov = figure["prov"][0]
+    inner_cells = index.contained_in(prov["page"], prov["bbox"], kinds={"cells"})
+    captions = index.nearest(prov["page"], prov["bbox"], k=1, types={"caption"})
+
+The `*_many` methods answer the same queries for many boxes of a page at once, with
+array operations over the candidate pairs found in the grid. The nearest queries search
+the grid cells in rings of growing width around each query, until none of the boxes
+outside the searched cells can be closer than the k-th candidate.
+
+All coordinates are in the frame of the converted document, i.e. [x0, y0, x1, y1] with the
+origin in the bottom-left corner of the page.
+"""
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Collections of the converted document which hold items with a `prov`
+ITEM_COLLECTIONS = [
+    "main-text",
+    "tables",
+    "figures",
+    "equations",
+    "footnotes",
+    "page-headers",
+    "page-footers",
+]
+
+# Collections whose items hold raw cells, as rows of [x0, y0, x1, y1, font, text]
+CELL_COLLECTIONS = ["tables", "figures"]
+
+# Maximum number of grid cells along each axis of a page
+MAX_GRID_SIZE = 64
+
+# Maximum number of box pairs compared at once in the bulk queries
+BULK_CHUNK_SIZE = 4_000_000
+
+
+def _as_boxes(bboxes) -> np.ndarray:
+    """Convert to an (n, 4) array of [x0, y0, x1, y1] with x0 <= x1 and y0 <= y1"""
+    boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    return np.hstack(
+        [
+            np.minimum(boxes[:, :2], boxes[:, 2:]),
+            np.maximum(boxes[:, :2], boxes[:, 2:]),
+        ]
+    )
+
+
+def _enumerate_ranges(counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Enumerate the ranges [0, counts[i]) as pairs of (i, position in the range)
+
+    E.g. counts [2, 0, 3] give the groups [0, 0, 2, 2, 2] and positions [0, 1, 0, 1, 2].
+    """
+    groups = np.repeat(np.arange(len(counts)), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return groups, positions
+
+
+def _intersects(queries: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    return (
+        (boxes[:, 0] <= queries[:, 2])
+        & (boxes[:, 2] >= queries[:, 0])
+        & (boxes[:, 1] <= queries[:, 3])
+        & (boxes[:, 3] >= queries[:, 1])
+    )
+
+
+def _is_contained(queries: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    return (
+        (boxes[:, 0] >= queries[:, 0])
+        & (boxes[:, 1] >= queries[:, 1])
+        & (boxes[:, 2] <= queries[:, 2])
+        & (boxes[:, 3] <= queries[:, 3])
+    )
+
+
+def _distances(queries: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """Euclidean distances between the query boxes and the boxes, row by row"""
+    dx = np.maximum(boxes[:, 0] - queries[:, 2], queries[:, 0] - boxes[:, 2])
+    dy = np.maximum(boxes[:, 1] - queries[:, 3], queries[:, 1] - boxes[:, 3])
+    return np.hypot(np.maximum(dx, 0.0), np.maximum(dy, 0.0))
+
+
+class PageSpatialIndex:
+    """
+    Uniform grid over the bounding boxes of a single page
+
+    Parameters
+    ----------
+    boxes : np.ndarray
+        Bounding boxes as an (n, 4) array of [x0, y0, x1, y1].
+    cell_size : float, Default=32.0
+        Size of the grid cells, in the units of the boxes. It is increased if the
+        grid would have more than `MAX_GRID_SIZE` cells along one axis.
+    """
+
+    def __init__(self, boxes, cell_size: float = 32.0):
+        self.boxes = _as_boxes(boxes)
+        n = len(self.boxes)
+
+        if n == 0:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+        else:
+            self.origin = self.boxes[:, :2].min(axis=0)
+            extent = self.boxes[:, 2:].max(axis=0) - self.origin
+        self.cell_size = max(cell_size, float(extent.max()) / MAX_GRID_SIZE, 1e-6)
+        self.nx, self.ny = (np.floor(extent / self.cell_size).astype(int) + 1).tolist()
+
+        # Enumerate all (grid cell, box) pairs and sort them by grid cell, such that
+        # the boxes of the grid cells in one row are a contiguous slice of `_cell_boxes`
+        lo = self._cell_coords(self.boxes[:, :2])
+        hi = self._cell_coords(self.boxes[:, 2:])
+        box_ids, cell_ids = self._cells_of(lo, hi)
+
+        order = np.argsort(cell_ids, kind="stable")
+        self._cell_boxes = box_ids[order]
+        self._cell_ptr = np.searchsorted(
+            cell_ids[order], np.arange(self.nx * self.ny + 1)
+        )
+
+        # Number of (grid cell, box) pairs in the grid cells [0, cx) x [0, cy), to
+        # bound the number of candidates of the bulk queries
+        cell_counts = np.diff(self._cell_ptr).reshape(self.ny, self.nx)
+        self._cum_counts = np.zeros((self.ny + 1, self.nx + 1), dtype=int)
+        self._cum_counts[1:, 1:] = cell_counts.cumsum(axis=0).cumsum(axis=1)
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def _cell_coords(self, points: np.ndarray) -> np.ndarray:
+        coords = np.floor((points - self.origin) / self.cell_size).astype(int)
+        return np.clip(coords, 0, [self.nx - 1, self.ny - 1])
+
+    def _cells_of(
+        self, lo: np.ndarray, hi: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """All (box, grid cell) pairs for boxes spanning the grid cells [lo, hi]"""
+        widths = hi[:, 0] - lo[:, 0] + 1
+        box_ids, local = _enumerate_ranges(widths * (hi[:, 1] - lo[:, 1] + 1))
+        cx = lo[box_ids, 0] + local % widths[box_ids]
+        cy = lo[box_ids, 1] + local // widths[box_ids]
+        return box_ids, cy * self.nx + cx
+
+    def _query_cells(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """First and last grid cells spanned by each query"""
+        return self._cell_coords(queries[:, :2]), self._cell_coords(queries[:, 2:])
+
+    def _candidate_pairs(
+        self, lo: np.ndarray, hi: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        All (query, box) pairs of the boxes in the grid cells [lo, hi] of each query,
+        without duplicates
+
+        The pairs are sorted by query, then by box.
+        """
+        query_ids, cell_ids = self._cells_of(lo, hi)
+        starts = self._cell_ptr[cell_ids]
+        pair_cells, offsets = _enumerate_ranges(self._cell_ptr[cell_ids + 1] - starts)
+        box_ids = self._cell_boxes[starts[pair_cells] + offsets]
+
+        keys = np.unique(query_ids[pair_cells] * len(self.boxes) + box_ids)
+        return np.divmod(keys, len(self.boxes))
+
+    def _candidate_chunks(self, lo: np.ndarray, hi: np.ndarray) -> Iterable[slice]:
+        """
+        Split the queries over the grid cells [lo, hi] in slices of at most
+        ~BULK_CHUNK_SIZE candidate pairs
+        """
+        hi = hi + 1
+        c = self._cum_counts
+        n_pairs = (
+            c[hi[:, 1], hi[:, 0]]
+            - c[lo[:, 1], hi[:, 0]]
+            - c[hi[:, 1], lo[:, 0]]
+            + c[lo[:, 1], lo[:, 0]]
+        )
+        cum_pairs = np.concatenate([[0], np.cumsum(n_pairs)])
+        start = 0
+        while start < len(lo):
+            end = np.searchsorted(
+                cum_pairs, cum_pairs[start] + BULK_CHUNK_SIZE, "right"
+            )
+            end = max(end - 1, start + 1)
+            yield slice(start, end)
+            start = end
+
+    def _filter_many(self, queries: np.ndarray, predicate) -> List[np.ndarray]:
+        """Ids of the candidate boxes satisfying `predicate(queries, boxes)`, per query"""
+        if len(self.boxes) == 0:
+            return [np.zeros(0, dtype=int) for _ in range(len(queries))]
+
+        results: List[np.ndarray] = []
+        lo, hi = self._query_cells(queries)
+        for chunk in self._candidate_chunks(lo, hi):
+            query_ids, box_ids = self._candidate_pairs(lo[chunk], hi[chunk])
+            hits = predicate(queries[chunk][query_ids], self.boxes[box_ids])
+            counts = np.bincount(query_ids[hits], minlength=len(lo[chunk]))
+            results.extend(np.split(box_ids[hits], np.cumsum(counts)[:-1]))
+        return results
+
+    def intersecting(self, bbox) -> np.ndarray:
+        """Ids of the boxes intersecting the given bbox"""
+        return self.intersecting_many([bbox])[0]
+
+    def contained_in(self, bbox, tolerance: float = 0.0) -> np.ndarray:
+        """Ids of the boxes fully inside the given bbox, expanded by the tolerance"""
+        return self.contained_in_many([bbox], tolerance=tolerance)[0]
+
+    def nearest(
+        self, bbox, k: int = 1, mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Ids and distances of the k boxes closest to the given bbox
+
+        Boxes intersecting the bbox have a distance of zero. The optional boolean
+        `mask` restricts the search to a subset of the boxes.
+        """
+        ids, distances = self.nearest_many([bbox], k=k, mask=mask)
+        return ids[0], distances[0]
+
+    def intersecting_many(self, bboxes) -> List[np.ndarray]:
+        """Ids of the boxes intersecting each of the given bboxes"""
+        return self._filter_many(_as_boxes(bboxes), _intersects)
+
+    def contained_in_many(self, bboxes, tolerance: float = 0.0) -> List[np.ndarray]:
+        """Ids of the boxes fully inside each of the given bboxes, expanded by the tolerance"""
+        queries = _as_boxes(bboxes) + np.array([-1, -1, 1, 1]) * tolerance
+        return self._filter_many(queries, _is_contained)
+
+    def nearest_many(
+        self, bboxes, k: int = 1, mask: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Ids and distances of the k boxes closest to each of the given bboxes
+
+        The grid cells around each query are searched in rings of doubling width,
+        until k candidates are found and the boxes outside the searched cells cannot
+        be closer than the k-th one.
+
+        Returns two (m, k') arrays, sorted by distance, where k' is k or the number of
+        candidate boxes if smaller.
+        """
+        if mask is not None and not np.all(mask):
+            # Search a grid of the selected boxes only, such that the rings do not
+            # grow over all the other boxes when the selection is sparse
+            selected = np.flatnonzero(mask)
+            subset = PageSpatialIndex(self.boxes[selected], cell_size=self.cell_size)
+            ids, distances = subset.nearest_many(bboxes, k=k)
+            return selected[ids], distances
+
+        queries = _as_boxes(bboxes)
+        k = min(k, len(self.boxes))
+        all_ids = np.zeros((len(queries), k), dtype=int)
+        all_distances = np.zeros((len(queries), k))
+        if k == 0:
+            return all_ids, all_distances
+
+        lo, hi = self._query_cells(queries)
+        last_cell = np.array([self.nx - 1, self.ny - 1])
+        pending = np.arange(len(queries))
+        ring = 0
+        while len(pending):
+            ring_lo = np.maximum(lo[pending] - ring, 0)
+            ring_hi = np.minimum(hi[pending] + ring, last_cell)
+
+            # Lower bound of the distance to the boxes outside the searched cells,
+            # there are no boxes beyond the sides reaching the border of the grid
+            gaps = np.hstack(
+                [
+                    queries[pending, :2] - (self.origin + ring_lo * self.cell_size),
+                    self.origin + (ring_hi + 1) * self.cell_size - queries[pending, 2:],
+                ]
+            )
+            gaps[np.hstack([ring_lo == 0, ring_hi == last_cell])] = np.inf
+            bounds = np.maximum(gaps.min(axis=1), 0.0)
+
+            settled = np.zeros(len(pending), dtype=bool)
+            for chunk in self._candidate_chunks(ring_lo, ring_hi):
+                query_ids, box_ids = self._candidate_pairs(
+                    ring_lo[chunk], ring_hi[chunk]
+                )
+                distances = _distances(
+                    queries[pending[chunk][query_ids]], self.boxes[box_ids]
+                )
+                order = np.lexsort((box_ids, distances, query_ids))
+                box_ids, distances = box_ids[order], distances[order]
+
+                counts = np.bincount(query_ids, minlength=len(ring_lo[chunk]))
+                starts = np.cumsum(counts) - counts
+                done = counts >= k
+                done[done] = distances[starts[done] + k - 1] <= bounds[chunk][done]
+                top = starts[done, None] + np.arange(k)
+                all_ids[pending[chunk][done]] = box_ids[top]
+                all_distances[pending[chunk][done]] = distances[top]
+                settled[chunk] = done
+
+            pending = pending[~settled]
+            ring = 2 * ring if ring else 1
+
+        return all_ids, all_distances
+
+
+class DocumentSpatialIndex:
+    """
+    Spatial index of all the items and raw cells of a converted document, by page
+
+    Each indexed box is described by an entry with the keys
+    - `kind`: the collection of the item (e.g. "main-text", "figures") or "cells",
+    - `type`: the type of the item (e.g. "paragraph", "caption"), or the font of a cell,
+    - `path`: the JSON path of the item, e.g. "#/figures/0" or "#/figures/0/cells/data/3",
+    - `text`: the text of the item or cell,
+    - `page` and `bbox`.
+
+    Parameters
+    ----------
+    document : dict
+        The converted document from Deep Search.
+    cell_size : float, Default=32.0
+        Size of the grid cells of each page index.
+    """
+
+    def __init__(self, document: dict, cell_size: float = 32.0):
+        page_entries: Dict[int, List[dict]] = {}
+
+        for collection in ITEM_COLLECTIONS:
+            for i, item in enumerate(document.get(collection) or []):
+                for prov in item.get("prov", []):
+                    page_entries.setdefault(prov["page"], []).append(
+                        {
+                            "kind": collection,
+                            "type": item.get("type"),
+                            "path": f"#/{collection}/{i}",
+                            "text": item.get("text", ""),
+                            "page": prov["page"],
+                            "bbox": prov["bbox"],
+                        }
+                    )
+
+        for collection in CELL_COLLECTIONS:
+            for i, item in enumerate(document.get(collection) or []):
+                cells = item.get("cells") or {}
+                if not item.get("prov") or not cells.get("data"):
+                    continue
+                page = item["prov"][0]["page"]
+                for j, (x0, y0, x1, y1, font, text) in enumerate(cells["data"]):
+                    page_entries.setdefault(page, []).append(
+                        {
+                            "kind": "cells",
+                            "type": font,
+                            "path": f"#/{collection}/{i}/cells/data/{j}",
+                            "text": text,
+                            "page": page,
+                            "bbox": [x0, y0, x1, y1],
+                        }
+                    )
+
+        self.entries: Dict[int, List[dict]] = page_entries
+        self.pages: Dict[int, PageSpatialIndex] = {
+            page: PageSpatialIndex([e["bbox"] for e in entries], cell_size=cell_size)
+            for page, entries in page_entries.items()
+        }
+        self._kinds = {
+            page: np.array([e["kind"] for e in entries])
+            for page, entries in page_entries.items()
+        }
+        self._types = {
+            page: np.array([str(e["type"]) for e in entries])
+            for page, entries in page_entries.items()
+        }
+
+    def _mask(
+        self, page: int, kinds: Optional[Set[str]], types: Optional[Set[str]]
+    ) -> np.ndarray:
+        mask = np.ones(len(self.entries[page]), dtype=bool)
+        if kinds is not None:
+            mask &= np.isin(self._kinds[page], list(kinds))
+        if types is not None:
+            mask &= np.isin(self._types[page], list(types))
+        return mask
+
+    def _select(self, page: int, ids: np.ndarray, mask: np.ndarray) -> List[dict]:
+        return [self.entries[page][i] for i in ids[mask[ids]]]
+
+    def intersecting(
+        self,
+        page: int,
+        bbox,
+        kinds: Optional[Set[str]] = None,
+        types: Optional[Set[str]] = None,
+    ) -> List[dict]:
+        """Entries on the page intersecting the bbox, optionally filtered by kind and type"""
+        return self.intersecting_many(page, [bbox], kinds=kinds, types=types)[0]
+
+    def contained_in(
+        self,
+        page: int,
+        bbox,
+        kinds: Optional[Set[str]] = None,
+        types: Optional[Set[str]] = None,
+        tolerance: float = 0.0,
+    ) -> List[dict]:
+        """Entries on the page fully inside the bbox, optionally filtered by kind and type"""
+        return self.contained_in_many(
+            page, [bbox], kinds=kinds, types=types, tolerance=tolerance
+        )[0]
+
+    def nearest(
+        self,
+        page: int,
+        bbox,
+        k: int = 1,
+        kinds: Optional[Set[str]] = None,
+        types: Optional[Set[str]] = None,
+        max_distance: Optional[float] = None,
+    ) -> List[dict]:
+        """The k entries on the page closest to the bbox, optionally filtered"""
+        return self.nearest_many(
+            page, [bbox], k=k, kinds=kinds, types=types, max_distance=max_distance
+        )[0]
+
+    def intersecting_many(
+        self,
+        page: int,
+        bboxes,
+        kinds: Optional[Set[str]] = None,
+        types: Optional[Set[str]] = None,
+    ) -> List[List[dict]]:
+        """Entries on the page intersecting each of the bboxes, optionally filtered"""
+        if page not in self.pages:
+            return [[] for _ in range(len(bboxes))]
+        mask = self._mask(page, kinds, types)
+        return [
+            self._select(page, ids, mask)
+            for ids in self.pages[page].intersecting_many(bboxes)
+        ]
+
+    def contained_in_many(
+        self,
+        page: int,
+        bboxes,
+        kinds: Optional[Set[str]] = None,
+        types: Optional[Set[str]] = None,
+        tolerance: float = 0.0,
+    ) -> List[List[dict]]:
+        """Entries on the page fully inside each of the bboxes, optionally filtered"""
+        if page not in self.pages:
+            return [[] for _ in range(len(bboxes))]
+        mask = self._mask(page, kinds, types)
+        return [
+            self._select(page, ids, mask)
+            for ids in self.pages[page].contained_in_many(bboxes, tolerance=tolerance)
+        ]
+
+    def nearest_many(
+        self,
+        page: int,
+        bboxes,
+        k: int = 1,
+        kinds: Optional[Set[str]] = None,
+        types: Optional[Set[str]] = None,
+        max_distance: Optional[float] = None,
+    ) -> List[List[dict]]:
+        """The k entries on the page closest to each of the bboxes, optionally filtered"""
+        if page not in self.pages:
+            return [[] for _ in range(len(bboxes))]
+        all_ids, all_distances = self.pages[page].nearest_many(
+            bboxes, k=k, mask=self._mask(page, kinds, types)
+        )
+        results = []
+        for ids, distances in zip(all_ids, all_distances):
+            if max_distance is not None:
+                ids = ids[distances <= max_distance]
+            results.append([self.entries[page][i] for i in ids])
+        return results
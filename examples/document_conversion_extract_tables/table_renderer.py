@@ -0,0 +1,278 @@
+# Copyright IBM Inc. All rights reserved.
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+This script renders the tables of converted documents to HTML, GitHub Markdown or CSV files.
+
+The span ownership of each table (which cell starts a row/column span and how many rows and
+columns it covers) is computed once per table with array operations, and the output is
+streamed to the file instead of being built by string concatenation. Whole corpora are
+rendered in parallel, one output file per document for HTML and Markdown, and one output
+file per table for CSV.
+
+$ python table_renderer.py --help
+
+ Usage: table_renderer.py [OPTIONS]
+
+╭─ Options ────────────────────────────────────────────────────────────────────────────────────────────────╮
+│ *          -i      PATH     Input directory with the converted JSON documents [default: None] [required] │
+│ *          -o      PATH     Output directory where the tables are saved [default: None] [required]       │
+│            -t      TEXT     Output format: html, md or csv [default: html]                               │
+│            -n      INTEGER  Number of worker processes [default: None]                                   │
+│    --help                   Show this message and exit.                                                  │
+╰──────────────────────────────────────────────────────────────────────────────────────────────────────────╯
+
+
+For example, run as
+$ python table_renderer.py -i ../../data/converted/ -o results_tables/ -t md
+"""
+
+import csv
+import html
+import json
+from functools import partial
+from io import StringIO
+from multiprocessing import Pool
+from pathlib import Path
+from typing import List, Optional, TextIO, Tuple
+
+import numpy as np
+import typer
+
+HEADER_LABELS = {
+    "row_header",
+    "row_multi_header",
+    "row_title",
+    "col_header",
+    "col_multi_header",
+}
+
+FILE_SUFFIXES = {"html": ".html", "md": ".md", "csv": ".csv"}
+
+
+class TableSpans:
+    """
+    Span ownership grid of a table
+
+    For each grid position (i, j), `rowstart`, `colstart`, `rowspan` and `colspan`
+    follow the semantics of the cell `spans` of the converted document: the cell is
+    rendered only at the position where its span starts, and a cell without spans
+    covers only its own position.
+    """
+
+    def __init__(self, table: dict):
+        self.nrows = table["#-rows"]
+        self.ncols = table["#-cols"]
+        shape = (self.nrows, self.ncols)
+
+        # Flatten all the spans into (cell, row, col) arrays
+        cell_ids, span_rows, span_cols = [], [], []
+        for i, row in enumerate(table["data"][: self.nrows]):
+            for j, cell in enumerate(row[: self.ncols]):
+                for r, c in cell["spans"]:
+                    cell_ids.append(i * self.ncols + j)
+                    span_rows.append(r)
+                    span_cols.append(c)
+        cell_ids = np.array(cell_ids, dtype=int)
+        span_rows = np.array(span_rows, dtype=int)
+        span_cols = np.array(span_cols, dtype=int)
+
+        size = self.nrows * self.ncols
+        grid_rows, grid_cols = np.divmod(np.arange(size), self.ncols)
+        self.rowstart = self._start(cell_ids, span_rows, grid_rows).reshape(shape)
+        self.colstart = self._start(cell_ids, span_cols, grid_cols).reshape(shape)
+        self.rowspan = self._count(cell_ids, span_rows, size).reshape(shape)
+        self.colspan = self._count(cell_ids, span_cols, size).reshape(shape)
+
+        grid_rows, grid_cols = grid_rows.reshape(shape), grid_cols.reshape(shape)
+        self.owner = (self.rowstart == grid_rows) & (self.colstart == grid_cols)
+
+    @staticmethod
+    def _start(cell_ids: np.ndarray, values: np.ndarray, default: np.ndarray):
+        start = np.full(len(default), np.iinfo(int).max)
+        np.minimum.at(start, cell_ids, values)
+        return np.where(start == np.iinfo(int).max, default, start)
+
+    @staticmethod
+    def _count(cell_ids: np.ndarray, values: np.ndarray, size: int):
+        # Number of distinct values per cell, at least one
+        pairs = np.unique(np.stack([cell_ids, values]), axis=1)
+        return np.maximum(np.bincount(pairs[0], minlength=size), 1)
+
+
+def _cell_texts(table: dict) -> List[List[str]]:
+    nrows, ncols = table["#-rows"], table["#-cols"]
+    return [[cell["text"] for cell in row[:ncols]] for row in table["data"][:nrows]]
+
+
+def write_table_html(table: dict, out: TextIO):
+    """Write the table as HTML, including column and row spans"""
+    spans = TableSpans(table)
+
+    out.write("<table>\n")
+    for i in range(spans.nrows):
+        out.write("  <tr>\n")
+        for j in np.flatnonzero(spans.owner[i]):
+            cell = table["data"][i][j]
+            content = html.escape(cell["text"]) or "&nbsp;"
+            if cell["type"] in HEADER_LABELS:
+                celltag, style = "th", 'style="text-align: center;"'
+            else:
+                celltag, style = "td", ""
+            out.write(
+                f'    <{celltag} rowstart="{spans.rowstart[i, j]}" '
+                f'colstart="{spans.colstart[i, j]}" rowspan="{spans.rowspan[i, j]}" '
+                f'colspan="{spans.colspan[i, j]}" {style}>{content}</{celltag}>\n'
+            )
+        out.write("  </tr>\n")
+    out.write("</table>")
+
+
+def write_table_markdown(table: dict, out: TextIO):
+    """
+    Write the table as GitHub Markdown, with the first row as header
+
+    Markdown has no spans, hence each grid position holds the text of its own cell.
+    """
+    rows = _cell_texts(table)
+    if not rows:
+        return
+
+    def _write_row(row: List[str]):
+        cells = [text.replace("|", "\\|").replace("\n", " ").strip() for text in row]
+        out.write("| " + " | ".join(cells) + " |\n")
+
+    _write_row(rows[0])
+    out.write("|" + "---|" * len(rows[0]) + "\n")
+    for row in rows[1:]:
+        _write_row(row)
+
+
+def write_table_csv(table: dict, out: TextIO):
+    """Write the table as CSV, each grid position holding the text of its own cell"""
+    csv.writer(out).writerows(_cell_texts(table))
+
+
+TABLE_WRITERS = {
+    "html": write_table_html,
+    "md": write_table_markdown,
+    "csv": write_table_csv,
+}
+
+
+def render_table(table: dict, fmt: str = "html") -> str:
+    """Render a single table to a string in the given format"""
+    out = StringIO()
+    TABLE_WRITERS[fmt](table, out)
+    return out.getvalue()
+
+
+def iter_document_tables(document: dict):
+    """Iterate over the tables of the document as (page, counter on the page, table)"""
+    page_counters = {}
+    for table in document.get("tables", []):
+        page = table["prov"][0]["page"]
+        page_counters[page] = page_counters.get(page, 0) + 1
+        yield page, page_counters[page], table
+
+
+def render_document(json_file: Path, output_dir: Path, fmt: str) -> List[Path]:
+    """
+    Render all the tables of a converted document and return the written files
+
+    HTML and Markdown tables are streamed in a single file per document, while each
+    table is written in its own CSV file, named `<document>_<page>_<counter>.csv`.
+    """
+    with open(json_file) as f:
+        document = json.load(f)
+    write = TABLE_WRITERS[fmt]
+    output_base = output_dir / json_file.stem
+
+    if fmt == "csv":
+        output_files = []
+        for page, counter, table in iter_document_tables(document):
+            output_file = output_base.with_name(
+                f"{output_base.name}_{page}_{counter}.csv"
+            )
+            with open(output_file, "w", newline="") as out:
+                write(table, out)
+            output_files.append(output_file)
+        return output_files
+
+    output_file = output_base.with_name(output_base.name + FILE_SUFFIXES[fmt])
+    with open(output_file, "w") as out:
+        for page, counter, table in iter_document_tables(document):
+            if fmt == "html":
+                out.write(f"<h2>Table {counter} on page {page}</h2>\n")
+            else:
+                out.write(f"## Table {counter} on page {page}\n\n")
+            write(table, out)
+            out.write("\n\n")
+    return [output_file]
+
+
+def render_corpus(
+    json_files: List[Path],
+    output_dir: Path,
+    fmt: str = "html",
+    processes: Optional[int] = None,
+) -> List[Tuple[Path, List[Path]]]:
+    """
+    Render the tables of all documents in parallel
+
+    Parameters
+    ----------
+    json_files : List[Path]
+        Converted documents from Deep Search.
+    output_dir : Path
+        Output directory where the tables are saved.
+    fmt : str, Default="html"
+        Output format, one of "html", "md" or "csv".
+    processes : int, Default=None
+        Number of worker processes. If not set, the number of CPUs is used.
+
+    Returns
+    -------
+    List[Tuple[Path, List[Path]]]
+        The output files written for each input document.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with Pool(processes=processes) as pool:
+        output_files = pool.map(
+            partial(render_document, output_dir=output_dir, fmt=fmt),
+            json_files,
+            chunksize=8,
+        )
+    return list(zip(json_files, output_files))
+
+
+def main(
+    input_dir: Path = typer.Option(
+        ..., "-i", help="Input directory with the converted JSON documents"
+    ),
+    output_dir: Path = typer.Option(
+        ..., "-o", help="Output directory where the tables are saved"
+    ),
+    fmt: str = typer.Option("html", "-t", help="Output format: html, md or csv"),
+    processes: Optional[int] = typer.Option(
+        None, "-n", help="Number of worker processes"
+    ),
+):
+    if fmt not in TABLE_WRITERS:
+        raise typer.BadParameter(f"format must be one of {', '.join(TABLE_WRITERS)}")
+
+    json_files = sorted(input_dir.rglob("*.json"))
+    results = render_corpus(json_files, output_dir, fmt=fmt, processes=processes)
+    for json_file, output_files in results:
+        typer.secho(
+            f"{len(output_files)} file(s) written for {json_file.name}",
+            fg=typer.colors.GREEN,
+        )
+
+
+if __name__ == "__main__":
+    app = typer.Typer(no_args_is_help=True, add_completion=False)
+    app.command()(main)
+    app()
@@ -0,0 +1,328 @@
+# Copyright IBM Inc. All rights reserved.
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+This script applies the deepsearch-glm NLP models on a corpus of converted documents and
+saves the extracted instances and properties as Parquet files.
+
+The documents are read in a stream, either from a directory of converted JSON documents
+(e.g. `data/converted`) or from JSONL exports of data queries (one document per line),
+and they are annotated in a pool of worker processes, each initializing the NLP model once.
+The results are written in columnar batches, without building any intermediate DataFrame.
+
+Please note that this script requires dependencies which are not available on Windows platforms.
+
+$ python annotate_corpus.py --help
+
+ Usage: annotate_corpus.py [OPTIONS]
+
+╭─ Options ────────────────────────────────────────────────────────────────────────────────────────────────────────────╮
+│ *          -i      PATH     Input directory of JSON documents, or JSONL file of documents [default: None] [required] │
+│ *          -o      PATH     Output directory where the Parquet files are saved [default: None] [required]            │
+│            -m      TEXT     NLP models to apply [default: language;term;material]                                    │
+│            -l      TEXT     Apply the models on each document (doc) or on each paragraph (text) [default: doc]       │
+│            -b      INTEGER  Number of rows in each Parquet record batch [default: 50000]                             │
+│            -n      INTEGER  Number of worker processes [default: None]                                               │
+│    --help                   Show this message and exit.                                                              │
+╰──────────────────────────────────────────────────────────────────────────────────────────────────────────────────────╯
+
+
+For example, run as
+$ python annotate_corpus.py -i ../../data/converted/ -o results_nlp/ -m "language;reference"
+"""
+
+import json
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import typer
+from deepsearch_glm.nlp_utils import init_nlp_model
+from deepsearch_glm.utils.load_pretrained_models import load_pretrained_nlp_models
+
+NLP_TABLES = ["instances", "properties"]
+PROV_HEADERS = {"doc": ["document"], "text": ["document", "item_index"]}
+
+# Parquet types of the NLP table columns, the remaining (text) columns are stored as
+# strings. The hashes of deepsearch-glm are unsigned 64-bit integers, and the columns
+# ending in _i and _j are the start and end offsets of the instances.
+COLUMN_TYPES = {
+    "item_index": pa.int64(),
+    "conf": pa.float64(),
+    "confidence": pa.float64(),
+    "wtok-match": pa.bool_(),
+}
+HASH_COLUMN_SUFFIX = "hash"
+OFFSET_COLUMN_SUFFIXES = ("_i", "_j")
+
+# A document is referenced either by its JSON file, or by its name and JSONL line
+DocumentRef = Union[Path, Tuple[str, str]]
+
+# Rows of each NLP table, as (headers, data)
+AnnotatedRows = Dict[str, Tuple[List[str], List[list]]]
+
+
+def iter_documents(input_path: Path) -> Iterator[DocumentRef]:
+    """
+    Stream the references of the documents to annotate
+
+    The documents are loaded in the worker processes, such that only the file
+    names (or the raw JSONL lines) are sent over the process boundary.
+    """
+    if input_path.is_dir():
+        yield from sorted(input_path.rglob("*.json"))
+        return
+
+    with open(input_path) as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                yield f"{input_path.name}:{i}", line
+
+
+def _load_document(ref: DocumentRef) -> Tuple[str, dict]:
+    if isinstance(ref, Path):
+        with open(ref) as f:
+            return ref.name, json.load(f)
+
+    name, line = ref
+    document = json.loads(line)
+    # Data query exports may contain the full hit, not only the source
+    document = document.get("_source", document)
+    return name, document
+
+
+_worker_model = None
+_worker_level = "doc"
+
+
+def _init_worker(model_names: str, level: str):
+    global _worker_model, _worker_level
+    _worker_model = init_nlp_model(model_names)
+    _worker_level = level
+
+
+def _annotate(ref: DocumentRef) -> AnnotatedRows:
+    name, document = _load_document(ref)
+
+    if _worker_level == "doc":
+        results = [(None, _worker_model.apply_on_doc(document))]
+    else:
+        results = [
+            (i, _worker_model.apply_on_text(item["text"]))
+            for i, item in enumerate(document.get("main-text", []))
+            if "text" in item
+        ]
+
+    # Keep the plain rows, each prefixed with the provenance of the annotation
+    rows: AnnotatedRows = {}
+    for item_index, res in results:
+        prov = [name] if item_index is None else [name, item_index]
+        for table in NLP_TABLES:
+            if table not in res:
+                continue
+            headers = PROV_HEADERS[_worker_level] + res[table]["headers"]
+            _, data = rows.setdefault(table, (headers, []))
+            data.extend(prov + row for row in res[table]["data"])
+    return rows
+
+
+def column_type(header: str) -> pa.DataType:
+    """Return the Parquet type of an NLP table column"""
+    if header.endswith(HASH_COLUMN_SUFFIX):
+        return pa.uint64()
+    if header.endswith(OFFSET_COLUMN_SUFFIXES):
+        return pa.int64()
+    return COLUMN_TYPES.get(header, pa.string())
+
+
+def _convert_value(value, dtype: pa.DataType):
+    if value is None:
+        return None
+    if pa.types.is_string(dtype):
+        return str(value)
+    if pa.types.is_floating(dtype):
+        return float(value)
+    if pa.types.is_boolean(dtype):
+        if isinstance(value, str):
+            if value.lower() not in ("true", "false"):
+                raise ValueError(f"invalid boolean {value!r}")
+            return value.lower() == "true"
+        return bool(value)
+    return int(value)
+
+
+class ParquetBatchWriter:
+    """
+    Accumulate rows and write them to a Parquet file in columnar record batches
+
+    The schema is declared from the headers with `column_type()`, and every value is
+    converted explicitly to the type of its column, such that all the batches share
+    the same schema whatever values they contain.
+    """
+
+    def __init__(self, filename: Path, batch_size: int = 50000):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.headers: Optional[List[str]] = None
+        self.rows: List[list] = []
+        self.writer: Optional[pq.ParquetWriter] = None
+        self.num_rows = 0
+
+    def add_rows(self, headers: List[str], rows: List[list]):
+        if self.headers is None:
+            self.headers = headers
+        elif headers != self.headers:
+            raise ValueError(
+                f"Unexpected headers {headers} for {self.filename}, "
+                f"expected {self.headers}"
+            )
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+
+        if self.writer is None:
+            schema = pa.schema([(h, column_type(h)) for h in self.headers])
+            self.writer = pq.ParquetWriter(self.filename, schema)
+
+        arrays = []
+        for field, values in zip(self.writer.schema, zip(*self.rows)):
+            try:
+                arrays.append(
+                    pa.array(
+                        [_convert_value(v, field.type) for v in values],
+                        type=field.type,
+                    )
+                )
+            except (ValueError, TypeError, OverflowError, pa.ArrowException) as e:
+                raise ValueError(
+                    f"Cannot convert the values of column {field.name} of "
+                    f"{self.filename} to {field.type}: {e}"
+                ) from e
+        table = pa.Table.from_arrays(arrays, schema=self.writer.schema)
+        self.writer.write_table(table)
+
+        self.num_rows += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+def annotate_corpus(
+    input_path: Path,
+    output_dir: Path,
+    model_names: str,
+    level: str = "doc",
+    batch_size: int = 50000,
+    processes: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Annotate all the documents and save the NLP tables in `<output_dir>/<table>.parquet`
+
+    Parameters
+    ----------
+    input_path : Path
+        Directory of converted JSON documents, or JSONL file with one document per line.
+    output_dir : Path
+        Output directory where the Parquet files are saved.
+    model_names : str
+        NLP models to apply, e.g. "language;term;material".
+    level : str, Default="doc"
+        Apply the models on each document ("doc") or on each paragraph ("text").
+    batch_size : int, Default=50000
+        Number of rows in each Parquet record batch.
+    processes : int, Default=None
+        Number of worker processes. If not set, the number of CPUs is used.
+
+    Returns
+    -------
+    Dict[str, int]
+        Number of rows written for each NLP table.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    writers = {
+        table: ParquetBatchWriter(output_dir / f"{table}.parquet", batch_size)
+        for table in NLP_TABLES
+    }
+
+    # Download the models once, before the workers load them
+    load_pretrained_nlp_models()
+
+    n_docs = 0
+    try:
+        with Pool(
+            processes=processes,
+            initializer=_init_worker,
+            initargs=(model_names, level),
+        ) as pool:
+            for rows in pool.imap_unordered(
+                _annotate, iter_documents(input_path), chunksize=4
+            ):
+                for table, (headers, data) in rows.items():
+                    writers[table].add_rows(headers, data)
+                n_docs += 1
+                if n_docs % 100 == 0:
+                    typer.secho(f"Annotated {n_docs} documents", fg=typer.colors.BLUE)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return {table: writer.num_rows for table, writer in writers.items()}
+
+
+def main(
+    input_path: Path = typer.Option(
+        ...,
+        "-i",
+        help="Input directory of JSON documents, or JSONL file of documents",
+    ),
+    output_dir: Path = typer.Option(
+        ..., "-o", help="Output directory where the Parquet files are saved"
+    ),
+    model_names: str = typer.Option(
+        "language;term;material", "-m", help="NLP models to apply"
+    ),
+    level: str = typer.Option(
+        "doc",
+        "-l",
+        help="Apply the models on each document (doc) or on each paragraph (text)",
+    ),
+    batch_size: int = typer.Option(
+        50000, "-b", help="Number of rows in each Parquet record batch"
+    ),
+    processes: Optional[int] = typer.Option(
+        None, "-n", help="Number of worker processes"
+    ),
+):
+    if level not in ("doc", "text"):
+        raise typer.BadParameter("level must be either doc or text")
+
+    num_rows = annotate_corpus(
+        input_path,
+        output_dir,
+        model_names,
+        level=level,
+        batch_size=batch_size,
+        processes=processes,
+    )
+    for table, n in num_rows.items():
+        typer.secho(
+            f"Saved {n} {table} in {output_dir / f'{table}.parquet'}",
+            fg=typer.colors.GREEN,
+        )
+
+
+if __name__ == "__main__":
+    app = typer.Typer(no_args_is_help=True, add_completion=False)
+    app.command()(main)
+    app()
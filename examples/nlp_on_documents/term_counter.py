@@ -0,0 +1,293 @@
+# Copyright IBM Inc. All rights reserved.
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+This script counts the occurrences of a list of terms in a corpus of converted documents.
+
+All terms are compiled into a single Aho-Corasick automaton, such that every document is
+scanned only once independently of the number of terms, and the documents are processed in
+parallel.
+
+$ python term_counter.py --help
+
+ Usage: term_counter.py [OPTIONS]
+
+╭─ Options ───────────────────────────────────────────────────────────────────────────────────────────────────────────────────╮
+│ *          -i                         PATH     Input directory with the converted JSON documents [default: None] [required] │
+│ *          -t                         PATH     Text file with one term per line [default: None] [required]                  │
+│ *          -o                         PATH     Output CSV file with the per-document counts [default: None] [required]      │
+│            --ignore-case/--match-case          Case-insensitive matching [default: ignore-case]                             │
+│            --word-boundary/--substring         Match only whole words [default: substring]                                  │
+│            -n                         INTEGER  Number of worker processes [default: None]                                   │
+│    --help                                      Show this message and exit.                                                  │
+╰─────────────────────────────────────────────────────────────────────────────────────────────────────────────────────────────╯
+
+
+For example, run as
+$ python term_counter.py -i ../../data/converted/ -t terms.txt -o term_counts.csv
+"""
+
+import json
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import typer
+
+
+def _is_word_char(text: str, pos: int) -> bool:
+    return 0 <= pos < len(text) and (text[pos].isalnum() or text[pos] == "_")
+
+
+def _is_word_boundary(text: str, pos: int) -> bool:
+    return _is_word_char(text, pos - 1) != _is_word_char(text, pos)
+
+
+class TermCounter:
+    """
+    Count the occurrences of many terms with a single scan of the text
+
+    The terms are compiled in an Aho-Corasick automaton, i.e. a trie of the terms
+    with failure links, such that the text is scanned once independently of the
+    number of terms, and overlapping terms (e.g. "inhibitor" and "corrosion
+    inhibitor") are all counted.
+
+    Parameters
+    ----------
+    terms : List[str]
+        Terms to count. The counts are returned in the same order.
+    ignore_case : bool, Default=True
+        Match the terms independently of the case, both in the terms and in the text.
+    word_boundary : bool, Default=False
+        Match the terms only as whole words, instead of any substring.
+    """
+
+    def __init__(
+        self, terms: List[str], ignore_case: bool = True, word_boundary: bool = False
+    ):
+        self.terms = list(terms)
+        self.ignore_case = ignore_case
+        self.word_boundary = word_boundary
+
+        # Trie of the normalized terms, the state 0 being the root
+        self._goto: List[Dict[str, int]] = [{}]
+        self._depth: List[int] = [0]
+        self._term_ids: List[List[int]] = [[]]  # ids of the terms ending at each state
+        for i, term in enumerate(self.terms):
+            key = self._normalize(term)
+            if not key:
+                continue
+            state = 0
+            for ch in key:
+                if ch not in self._goto[state]:
+                    self._goto.append({})
+                    self._depth.append(self._depth[state] + 1)
+                    self._term_ids.append([])
+                    self._goto[state][ch] = len(self._goto) - 1
+                state = self._goto[state][ch]
+            self._term_ids[state].append(i)
+
+        # Failure links, to the state of the longest proper suffix in the trie, and
+        # output links, to the closest state on the failure chain where a term ends
+        n_states = len(self._goto)
+        self._fail = [0] * n_states
+        self._output = [0] * n_states
+        bfs_order = [0]
+        for state in bfs_order:
+            for ch, child in self._goto[state].items():
+                bfs_order.append(child)
+                if state == 0:
+                    continue
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[child] = fail
+                self._output[child] = (
+                    fail if self._term_ids[fail] else self._output[fail]
+                )
+        self._has_match = np.array(
+            [bool(self._term_ids[s] or self._output[s]) for s in range(n_states)]
+        )
+
+        # States grouped by depth, from the deepest level to the first one
+        depth = np.array(self._depth)
+        fail = np.array(self._fail)
+        self._levels = [
+            (states, fail[states])
+            for states in (
+                np.flatnonzero(depth == d) for d in range(depth.max(), 0, -1)
+            )
+        ]
+
+        # State where each term ends, the root for the empty terms which never match
+        self._term_states = np.zeros(len(self.terms), dtype=int)
+        for state, term_ids in enumerate(self._term_ids):
+            self._term_states[term_ids] = state
+
+    def _normalize(self, text: str) -> str:
+        return text.lower() if self.ignore_case else text
+
+    def _scan(self, text: str) -> np.ndarray:
+        """Return the state of the automaton after each character of the text"""
+        goto, fail = self._goto, self._fail
+        states = []
+        state = 0
+        for ch in text:
+            next_state = goto[state].get(ch)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(ch)
+            state = next_state or 0
+            states.append(state)
+        return np.array(states, dtype=int)
+
+    def _count_states(self, text: str, states: np.ndarray) -> np.ndarray:
+        """Return the number of matches ending at each state"""
+        n_states = len(self._goto)
+        if not self.word_boundary:
+            # A term ends at every visit of its state or of a state whose failure
+            # chain contains it: accumulate the visits from the leaves to the root
+            counts = np.bincount(states, minlength=n_states)
+            for level_states, level_fails in self._levels:
+                np.add.at(counts, level_fails, counts[level_states])
+            counts[0] = 0
+            return counts
+
+        counts = np.zeros(n_states, dtype=int)
+        for end in np.flatnonzero(self._has_match[states]):
+            if not _is_word_boundary(text, end + 1):
+                continue
+            state = states[end]
+            if not self._term_ids[state]:
+                state = self._output[state]
+            while state:
+                if _is_word_boundary(text, end + 1 - self._depth[state]):
+                    counts[state] += 1
+                state = self._output[state]
+        return counts
+
+    def count_text(self, text: str) -> np.ndarray:
+        """Return the count of each term in the text"""
+        text = self._normalize(text)
+        state_counts = self._count_states(text, self._scan(text))
+        return state_counts[self._term_states]
+
+    def count_texts(self, texts: List[str]) -> np.ndarray:
+        """Return the count of each term summed over all the texts"""
+        # The texts are scanned in one pass, separated such that no match spans two texts
+        return self.count_text("\n\n".join(texts))
+
+    def count_doc(self, document: dict) -> np.ndarray:
+        """Return the count of each term in the `main-text` items of a converted document"""
+        return self.count_texts(
+            [item["text"] for item in document.get("main-text", []) if "text" in item]
+        )
+
+
+_worker_counter: Optional[TermCounter] = None
+
+
+def _init_worker(terms: List[str], ignore_case: bool, word_boundary: bool):
+    global _worker_counter
+    _worker_counter = TermCounter(
+        terms, ignore_case=ignore_case, word_boundary=word_boundary
+    )
+
+
+def _count_file(filename: Path) -> np.ndarray:
+    with open(filename) as f:
+        document = json.load(f)
+    return _worker_counter.count_doc(document)
+
+
+def count_terms_in_corpus(
+    terms: List[str],
+    json_files: List[Path],
+    ignore_case: bool = True,
+    word_boundary: bool = False,
+    processes: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Count the terms in each converted document, using a pool of worker processes
+
+    Parameters
+    ----------
+    terms : List[str]
+        Terms to count. Duplicated terms are counted once.
+    json_files : List[Path]
+        Converted documents from Deep Search.
+    ignore_case : bool, Default=True
+        Match the terms independently of the case.
+    word_boundary : bool, Default=False
+        Match the terms only as whole words.
+    processes : int, Default=None
+        Number of worker processes. If not set, the number of CPUs is used.
+
+    Returns
+    -------
+    pd.DataFrame
+        Counts with one row per document and one column per term. The aggregated
+        histogram over the corpus is obtained with `df.sum()`.
+    """
+    terms = list(dict.fromkeys(terms))
+    with Pool(
+        processes=processes,
+        initializer=_init_worker,
+        initargs=(terms, ignore_case, word_boundary),
+    ) as pool:
+        counts = pool.map(_count_file, json_files, chunksize=16)
+
+    data = np.vstack(counts) if counts else np.zeros((0, len(terms)), dtype=int)
+    return pd.DataFrame(data, index=[Path(f).name for f in json_files], columns=terms)
+
+
+def main(
+    input_dir: Path = typer.Option(
+        ..., "-i", help="Input directory with the converted JSON documents"
+    ),
+    terms_file: Path = typer.Option(..., "-t", help="Text file with one term per line"),
+    output_file: Path = typer.Option(
+        ..., "-o", help="Output CSV file with the per-document counts"
+    ),
+    ignore_case: bool = typer.Option(
+        True, "--ignore-case/--match-case", help="Case-insensitive matching"
+    ),
+    word_boundary: bool = typer.Option(
+        False, "--word-boundary/--substring", help="Match only whole words"
+    ),
+    processes: Optional[int] = typer.Option(
+        None, "-n", help="Number of worker processes"
+    ),
+):
+
+    terms = [line.strip() for line in terms_file.read_text().splitlines()]
+    terms = [term for term in terms if term]
+    json_files = sorted(input_dir.rglob("*.json"))
+    typer.secho(
+        f"Counting {len(terms)} terms in {len(json_files)} documents",
+        fg=typer.colors.BLUE,
+    )
+
+    df = count_terms_in_corpus(
+        terms,
+        json_files,
+        ignore_case=ignore_case,
+        word_boundary=word_boundary,
+        processes=processes,
+    )
+    df.to_csv(output_file)
+    typer.secho(f"Term counts saved in {output_file}", fg=typer.colors.GREEN)
+
+    term_hist = df.sum().sort_values(ascending=False)
+    print(term_hist.to_string())
+
+
+if __name__ == "__main__":
+    app = typer.Typer(no_args_is_help=True, add_completion=False)
+    app.command()(main)
+    app()
@@ -0,0 +1,354 @@
+# Copyright IBM Inc. All rights reserved.
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+This script runs a batch of questions with RAGQuery or SemanticQuery against private data
+sources of a project, and aggregates the query timings into latency percentiles per stage.
+
+The questions are read from a text file (one question per line), or from a JSONL file where
+each line is an object like
+    {"id": "q1", "question": "...", "index_key": "...", "document_hash": "..."}
+in which `id`, `index_key` and `document_hash` are optional and default to the command-line
+values. The queries are submitted concurrently, up to the configured limit, and the answers
+with their grounding and provenance are written to a JSONL file.
+
+$ python run_batch_qa.py --help
+
+ Usage: run_batch_qa.py [OPTIONS]
+
+╭─ Options ───────────────────────────────────────────────────────────────────────────────────────────╮
+│ *          -i      PATH     Questions file, plain text or JSONL [default: None] [required]          │
+│ *          -o      PATH     Output JSONL file with the answers [default: None] [required]           │
+│ *          -p      TEXT     Deep Search project key [default: None] [required]                      │
+│            -c      TEXT     Default collection (index) key of the questions [default: None]         │
+│            -d      TEXT     Default document hash of the questions [default: None]                  │
+│            -q      TEXT     Query type, rag or semantic [default: rag]                              │
+│            -k      INTEGER  Number of search results to retrieve [default: 3]                       │
+│            --rerank         Rerank the retrieved search results                                     │
+│            -a      INTEGER  Number of next-best answers to generate (rag only) [default: 0]         │
+│            -t      INTEGER  Generation timeout in seconds (rag only) [default: 10]                  │
+│            -n      INTEGER  Number of concurrent queries [default: 5]                               │
+│            -f      TEXT     Profile to use. If not set, active profile will be used [default: None] │
+│    --help                   Show this message and exit.                                             │
+╰─────────────────────────────────────────────────────────────────────────────────────────────────────╯
+
+
+For example, run as
+$ python run_batch_qa.py -i questions.txt -o answers.jsonl -p $PROJ_KEY -c $INDEX_KEY -n 10
+"""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import typer
+from deepsearch.cps.client.api import CpsApi
+from deepsearch.cps.client.components.documents import create_private_data_source
+from deepsearch.cps.queries import RAGQuery, SemanticQuery
+from deepsearch.cps.queries.results import RAGResult, SearchResult
+from rich.console import Console
+from rich.table import Table
+
+# Grouping of the timing details reported by the QA task into the main stages.
+# The detail names are not part of the query API contract, they are what the service
+# reports at the time of writing: unknown details are kept as they are.
+STAGES = {
+    "retrieval": ["encode", "search"],
+    "rerank": ["rerank"],
+    "generation": ["extr_gen_ctx", "generate"],
+}
+
+
+def read_questions(
+    input_file: Path, index_key: Optional[str], document_hash: Optional[str]
+) -> List[dict]:
+    questions = []
+    with open(input_file) as f:
+        for i, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            if input_file.suffix == ".jsonl":
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise typer.BadParameter(
+                        f"line {i + 1} of {input_file} is not valid JSON: {e}"
+                    )
+                if not isinstance(entry, dict):
+                    raise typer.BadParameter(
+                        f"line {i + 1} of {input_file} is not a JSON object"
+                    )
+            else:
+                entry = {"question": line}
+            question = entry.get("question")
+            if not isinstance(question, str) or not question.strip():
+                raise typer.BadParameter(
+                    f"line {i + 1} of {input_file} has no question"
+                )
+            entry.setdefault("id", str(i))
+            entry.setdefault("index_key", index_key)
+            entry.setdefault("document_hash", document_hash)
+            if entry["index_key"] is None:
+                raise typer.BadParameter(
+                    f"no index_key for question {entry['id']}, set a default with -c"
+                )
+            questions.append(entry)
+    return questions
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def stage_timings(timings) -> Dict[str, float]:
+    """
+    Flatten the query timings into a mapping of stage -> seconds
+
+    Besides the overall timing and the raw details of each task, the details are
+    summed into the stages defined in `STAGES`. The task details are not typed by the
+    toolkit, hence the stage mapping is an assumption on their names and the details
+    which are not numbers are skipped.
+    """
+    flat = {}
+    if _is_number(timings.overall):
+        flat["overall"] = timings.overall
+    for task in timings.tasks.values():
+        details = task.details if isinstance(task.details, dict) else {}
+        for detail, value in details.items():
+            if _is_number(value):
+                flat[detail] = flat.get(detail, 0.0) + value
+    for stage, details in STAGES.items():
+        if any(d in flat for d in details):
+            flat[stage] = sum(flat.get(d, 0.0) for d in details)
+    return flat
+
+
+def run_question(
+    api: CpsApi,
+    proj_key: str,
+    entry: dict,
+    query_type: str,
+    retr_k: int,
+    rerank: bool,
+    next_best: int,
+    gen_timeout: int,
+) -> dict:
+    data_source = create_private_data_source(
+        proj_key=proj_key,
+        index_key=entry["index_key"],
+        document_hash=entry["document_hash"],
+    )
+    record = {
+        "id": entry["id"],
+        "question": entry["question"],
+        "index_key": entry["index_key"],
+        "document_hash": entry["document_hash"],
+    }
+    # (client seconds, query timings) of each query, flattened once the answers are in
+    raw_timings = []
+
+    def _run(query):
+        start = time.monotonic()
+        api_output = api.queries.run(query)
+        raw_timings.append((time.monotonic() - start, api_output.timings))
+        return api_output
+
+    if query_type == "semantic":
+        query = SemanticQuery(
+            question=entry["question"],
+            project=proj_key,
+            data_source=data_source,
+            retr_k=retr_k,
+            rerank=rerank,
+        )
+        result = SearchResult.from_api_output(_run(query))
+        record["search_result_items"] = [
+            item.dict() for item in result.search_result_items
+        ]
+    else:
+        query = RAGQuery(
+            question=entry["question"],
+            project=proj_key,
+            data_source=data_source,
+            retr_k=retr_k,
+            rerank=rerank,
+            gen_timeout=gen_timeout,
+        )
+        rag_result = RAGResult.from_api_output(_run(query))
+        answers = list(rag_result.answers)
+
+        # Generate the next-best answers from the other retrieved chunks
+        for chunk_ref in rag_result.search_result_items[1 : next_best + 1]:
+            query = RAGQuery(
+                question=entry["question"],
+                project=proj_key,
+                data_source=data_source,
+                retr_k=retr_k,
+                rerank=rerank,
+                chunk_refs=[chunk_ref],
+                gen_timeout=gen_timeout,
+            )
+            answers.extend(RAGResult.from_api_output(_run(query)).answers)
+
+        record["answers"] = [answer.dict() for answer in answers]
+        record["search_result_items"] = [
+            item.dict() for item in rag_result.search_result_items
+        ]
+
+    record["timings"] = [
+        {**stage_timings(timings), "client": client} for client, timings in raw_timings
+    ]
+    return record
+
+
+async def run_batch(
+    api: CpsApi,
+    proj_key: str,
+    questions: List[dict],
+    output_file: Path,
+    concurrency: int,
+    **query_args,
+) -> List[Dict[str, float]]:
+    """
+    Run all questions concurrently, write the records to JSONL and return the timings
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run_question(pool, entry: dict):
+        async with semaphore:  # This will limit the number of concurrent queries
+            try:
+                # api.queries.run is blocking, run it in the thread pool
+                return await loop.run_in_executor(
+                    pool, partial(run_question, api, proj_key, entry, **query_args)
+                )
+            except Exception as e:
+                return {
+                    "id": entry.get("id"),
+                    "question": entry.get("question"),
+                    "error": str(e),
+                }
+
+    all_timings = []
+    n_done = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        tasks = [_run_question(pool, q) for q in questions]
+        with open(output_file, "w") as fw:
+            for future in asyncio.as_completed(tasks):
+                record = await future
+                fw.write(json.dumps(record, default=str) + "\n")
+                all_timings.extend(record.get("timings", []))
+
+                n_done += 1
+                if "error" in record:
+                    typer.secho(
+                        f"Question {record['id']} failed: {record['error']}",
+                        fg=typer.colors.RED,
+                    )
+                if n_done % 50 == 0:
+                    typer.secho(f"{n_done}/{len(questions)} questions completed")
+
+    return all_timings
+
+
+def print_latency_table(all_timings: List[Dict[str, float]]):
+    table = Table(title="Latency per stage (seconds)", show_lines=True)
+    for column in ["Stage", "Count", "Mean", "p50", "p95", "Max"]:
+        table.add_column(column)
+
+    stages = ["client", "overall", *STAGES]
+    stages += sorted({s for t in all_timings for s in t} - set(stages))
+    for stage in stages:
+        values = np.array([t[stage] for t in all_timings if stage in t])
+        if len(values) == 0:
+            continue
+        p50, p95 = np.percentile(values, [50, 95])
+        table.add_row(
+            stage,
+            str(len(values)),
+            f"{values.mean():.3f}",
+            f"{p50:.3f}",
+            f"{p95:.3f}",
+            f"{values.max():.3f}",
+        )
+
+    console = Console()
+    console.print(table)
+
+
+def main(
+    input_file: Path = typer.Option(
+        ..., "-i", help="Questions file, plain text or JSONL"
+    ),
+    output_file: Path = typer.Option(
+        ..., "-o", help="Output JSONL file with the answers"
+    ),
+    proj_key: str = typer.Option(..., "-p", help="Deep Search project key"),
+    index_key: Optional[str] = typer.Option(
+        None, "-c", help="Default collection (index) key of the questions"
+    ),
+    document_hash: Optional[str] = typer.Option(
+        None, "-d", help="Default document hash of the questions"
+    ),
+    query_type: str = typer.Option("rag", "-q", help="Query type, rag or semantic"),
+    retr_k: int = typer.Option(3, "-k", help="Number of search results to retrieve"),
+    rerank: bool = typer.Option(
+        False, "--rerank", help="Rerank the retrieved search results"
+    ),
+    next_best: int = typer.Option(
+        0, "-a", help="Number of next-best answers to generate (rag only)"
+    ),
+    gen_timeout: int = typer.Option(
+        10, "-t", help="Generation timeout in seconds (rag only)"
+    ),
+    concurrency: int = typer.Option(5, "-n", help="Number of concurrent queries"),
+    profile_name: Optional[str] = typer.Option(
+        None,
+        "-f",
+        help="Profile to use. If not set, active profile will be used",
+    ),
+):
+    if query_type not in ("rag", "semantic"):
+        raise typer.BadParameter("query type must be either rag or semantic")
+
+    questions = read_questions(input_file, index_key, document_hash)
+    api = CpsApi.from_env(profile_name=profile_name)
+    typer.secho(f"Running {len(questions)} questions", fg=typer.colors.BLUE)
+
+    start = time.monotonic()
+    all_timings = asyncio.run(
+        run_batch(
+            api,
+            proj_key,
+            questions,
+            output_file,
+            concurrency,
+            query_type=query_type,
+            retr_k=retr_k,
+            rerank=rerank,
+            next_best=next_best,
+            gen_timeout=gen_timeout,
+        )
+    )
+    elapsed = time.monotonic() - start
+
+    typer.secho(
+        f"Answers saved in {output_file}. {len(all_timings)} queries in "
+        f"{elapsed:.1f}s ({len(all_timings) / elapsed:.2f} queries/s)",
+        fg=typer.colors.GREEN,
+    )
+    print_latency_table(all_timings)
+
+
+if __name__ == "__main__":
+    app = typer.Typer(no_args_is_help=True, add_completion=False)
+    app.command()(main)
+    app()